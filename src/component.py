@@ -1,22 +1,139 @@
 import logging
+import os
+import shutil
 import requests
 import pandas
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
 from keboola.component.base import ComponentBase
 from keboola.component.exceptions import UserException
 
+from dedup import PrimaryKeyIndex
+from lineage import LINEAGE_TABLES, LineageGraph, split_node
+from monitor import RefreshMonitor, refresh_schedule, refresh_state, retry_after
+from pipeline import FetchPipeline, RateLimiter
+from planner import plan_stage, plan_summary
+from refresh_stats import RefreshStatistics
+from scheduler import WorkScheduler
+from skip_index import SkipIndex
+from snapshot import RowSnapshot
+from writer import SlicedTableWriter, to_json
+
 # configuration variables
 KEY_CLIENT_ID = '#client_id'
 KEY_PASSWORD = '#password'
 KEY_USERNAME = '#username'
 KEY_INCREMENTAL = 'incremental'
+KEY_DELTA_OUTPUT = 'delta_output'
+KEY_DELETED_ROWS = 'deleted_rows'
+KEY_SLICED_OUTPUT = 'sliced_output'
+KEY_SKIP_DEAD_ENDPOINTS = 'skip_dead_endpoints'
+KEY_MAX_RUNTIME = 'max_runtime'
+KEY_LINEAGE = 'lineage'
+KEY_TABLES = 'tables'
+KEY_CONCURRENCY = 'concurrency'
+KEY_REQUESTS_PER_HOUR = 'requests_per_hour'
 
 # list of mandatory parameters => if some is missing,
 # component will fail with readable message on initialization.
 REQUIRED_PARAMETERS = [KEY_CLIENT_ID, KEY_PASSWORD, KEY_USERNAME, KEY_INCREMENTAL]
 REQUIRED_IMAGE_PARS = []
 
+# extraction stages (get_pbi_<stage> methods) with the stage providing their input
+STAGE_PARENTS = {
+    'groups': None,
+    'users': 'groups',
+    'datasets': 'groups',
+    'dashboards': 'groups',
+    'reports': 'groups',
+    'gateways': None,
+    'datasources_gateway': 'gateways',
+    'datasets_refreshes': 'datasets',
+    'datasets_datasources': 'datasets',
+    'datasets_refresh_schedule': 'datasets'
+}
+
+# output tables of the extraction stages
+STAGE_TABLES = {
+    'groups': ['pbi_groups.csv', 'pbi_groups_refresh.csv'],
+    'users': ['pbi_users.csv'],
+    'datasets': ['pbi_datasets.csv', 'pbi_datasets_refresh.csv'],
+    'dashboards': ['pbi_dashboards.csv', 'pbi_dashboards_refresh.csv'],
+    'reports': ['pbi_reports.csv', 'pbi_reports_actual.csv'],
+    'gateways': ['pbi_gateways.csv'],
+    'datasources_gateway': ['pbi_datasources_gateway.csv'],
+    'datasets_refreshes': ['pbi_datasets_refreshes.csv', 'pbi_datasets_refresh_stats.csv'],
+    'datasets_datasources': ['pbi_datasets_datasources.csv'],
+    'datasets_refresh_schedule': ['pbi_datasets_refresh_schedule_times.csv', 'pbi_datasets_refresh_schedule_days.csv',
+                                  'pbi_datasets_refresh_schedule_enable.csv']
+}
+
+# tables the `tables` parameter selects columns of or disables
+CONFIGURABLE_TABLES = [name for tables in STAGE_TABLES.values() for name in tables] + [
+    'pbi_lineage_edges.csv', 'pbi_lineage_closure.csv', 'pbi_datasets_refresh_transitions.csv']
+
+# column with the id of the stage entity the rows of the table were fetched for
+PARENT_COLUMNS = {
+    'pbi_users.csv': 'groups_id_parent',
+    'pbi_datasets.csv': 'group_id_parent',
+    'pbi_datasets_refresh.csv': 'parent_id',
+    'pbi_dashboards.csv': 'group_id_parent',
+    'pbi_dashboards_refresh.csv': 'parent_id',
+    'pbi_reports.csv': 'group_id_parent',
+    'pbi_reports_actual.csv': 'parent_id',
+    'pbi_datasources_gateway.csv': 'gateway_id',
+    'pbi_datasets_refreshes.csv': 'dataset_id_parent',
+    'pbi_datasets_datasources.csv': 'dataset_id_parent',
+    'pbi_datasets_refresh_schedule_times.csv': 'parent_id',
+    'pbi_datasets_refresh_schedule_days.csv': 'parent_id',
+    'pbi_datasets_refresh_schedule_enable.csv': 'parent_id'
+}
+
+# columns holding lists of objects, written as compact JSON
+NESTED_COLUMNS = ['users', 'subscriptions', 'upstreamDatasets']
+
+# tables whose rows are used as the input of the following stages
+PARENT_TABLES = ['pbi_groups.csv', 'pbi_datasets.csv', 'pbi_gateways.csv']
+# tables loaded with delete_where, their unchanged rows have to be written again so they are never diffed
+DELTA_EXCLUDED_TABLES = ['pbi_lineage_edges.csv', 'pbi_lineage_closure.csv']
+# history tables whose source returns a rolling window only, rows leaving the window are not reported as deleted
+DELETES_EXCLUDED_TABLES = ['pbi_datasets_refreshes.csv']
+# tag of the files with row snapshots of the delta output, the next run reads them through the file input mapping
+SNAPSHOT_TAG = 'pbi_delta_snapshot'
+# number of threads compressing slices of sliced output tables
+COMPRESSION_THREADS = min(4, os.cpu_count() or 1)
+# how long the monitor action runs when no max_runtime is configured, in seconds
+MONITOR_RUNTIME = 55 * 60
+# how often the monitor re-evaluates which datasets to track, in seconds
+MONITOR_TRACKING_INTERVAL = 60
+
+# how many times a throttled request is retried after the time given by the Retry-After header
+MAX_THROTTLE_RETRIES = 3
+# response codes of calls which are skipped in the following runs
+SKIPPED_STATUS_CODES = [401, 403, 404]
+# endpoints of the skip index called by the extraction stages
+SKIP_ENDPOINTS = {
+    'users': 'users',
+    'datasets': 'datasets',
+    'dashboards': 'dashboards',
+    'reports': 'reports',
+    'datasources_gateway': 'gateway_datasources',
+    'datasets_refreshes': 'refreshes',
+    'datasets_datasources': 'datasources',
+    'datasets_refresh_schedule': 'refresh_schedule'
+}
+
+
+def _descendants(stage, stages):
+    """
+    Returns the stages depending on the stage directly or through other stages.
+    """
+    children = [child for child in stages if STAGE_PARENTS[child] == stage]
+    return children + [descendant for child in children for descendant in _descendants(child, stages)]
+
 
 class Component(ComponentBase):
     """
@@ -34,6 +151,45 @@ class Component(ComponentBase):
         self.access_token = None
         self.get_api_token()
         self.incremental = self.get_incremental()
+        self.delta_output = self.configuration.parameters.get(KEY_DELTA_OUTPUT, False)
+        self.deleted_rows = self.configuration.parameters.get(KEY_DELETED_ROWS, False)
+        self.sliced_output = self.configuration.parameters.get(KEY_SLICED_OUTPUT, False)
+        self.table_columns = self._get_table_columns()
+        self.disabled_tables = {f"{name}.csv" for name, columns in self.table_columns.items() if not columns}
+        self.state = self.get_state_file()
+        self.pk_indexes = {}
+        self.snapshots = {}
+        self.snapshot_inputs = None
+        self.parent_rows = {}
+        self.writers = {}
+        self.executor = None
+        self.concurrency = max(1, self.configuration.parameters.get(KEY_CONCURRENCY) or 1)
+        self.pipeline = None
+        self.fetched_ids = {}
+        self.scheduler = WorkScheduler(self.state.get('scheduler'), self.configuration.parameters.get(KEY_MAX_RUNTIME))
+        self.current_stage = None
+        self.table_stages = {}
+        self.lineage = None
+        if self.configuration.parameters.get(KEY_LINEAGE, False):
+            self.lineage = LineageGraph(self.state.get('lineage'))
+        self.refresh_stats = None
+        if 'pbi_datasets_refresh_stats.csv' not in self.disabled_tables:
+            self.refresh_stats = RefreshStatistics(self.state.get('refresh_stats'))
+        self.skip_index = None
+        if self.configuration.parameters.get(KEY_SKIP_DEAD_ENDPOINTS, False):
+            self.skip_index = SkipIndex(self.state.get('skip_index'))
+
+    def _get_table_columns(self):
+        """
+        Returns the column selection of the `tables` parameter, entries not matching an output table are ignored.
+        """
+        table_columns = {}
+        for name, columns in (self.configuration.parameters.get(KEY_TABLES) or {}).items():
+            if f"{name}.csv" not in CONFIGURABLE_TABLES:
+                logging.warning(f"Table {name} in the tables parameter is not an output table, ignored")
+                continue
+            table_columns[name] = columns
+        return table_columns
 
     def get_incremental(self):
         params = self.configuration.parameters
@@ -56,29 +212,426 @@ class Component(ComponentBase):
         response = requests.post(url, data=body).json()
         self.access_token = response['access_token']
 
+    def _get_json(self, url, endpoint, entity_id, limiter):
+        """
+        Calls per-entity endpoint, returns the response status and the response, None for failed calls.
+        Throttled calls are retried once the rate limiter shared by the fetch workers is paused for Retry-After.
+        With skipping of dead endpoints enabled, calls failing with an access error are recorded in the skip index,
+        as well as calls returning no data.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            limiter.wait()
+            response = requests.get(url, headers=headers)
+            if response.status_code != 429 or attempt == MAX_THROTTLE_RETRIES:
+                break
+            wait = retry_after(response.headers.get('Retry-After'), time.time())
+            logging.warning(f"{endpoint}: request for {entity_id} throttled, retrying in {wait:.0f} s")
+            limiter.pause(wait)
+        status = response.status_code
+
+        if self.skip_index is not None and status in SKIPPED_STATUS_CODES and 'TokenExpired' not in response.text:
+            logging.debug(f"{endpoint}: {entity_id} not accessible ({status}), skipping in next runs")
+            self.skip_index.mark(endpoint, entity_id)
+            return status, None
+
+        if not response.ok:
+            logging.warning(f"{endpoint}: request for {entity_id} failed ({status})")
+            return status, None
+
+        try:
+            response = response.json()
+        except ValueError:
+            logging.warning(f"{endpoint}: response for {entity_id} is not valid JSON")
+            return status, None
+
+        if self.skip_index is not None and response.get('value') == []:
+            self.skip_index.mark(endpoint, entity_id, empty=True)
+        return status, response
+
+    def _fetch_stage(self, stage, entities, url, key=None, interval=0):
+        """
+        Yields (entity, response) of the stage in the scheduler order. Up to `concurrency` requests run
+        in the background while the previous responses are processed, the url template is formatted
+        with the entity. Requests of the stage are started at least `interval` seconds apart. The response
+        is None for failed calls and for calls recently failing or returning no data, which are not made
+        when skipping of dead endpoints is enabled.
+
+        Latency is recorded for every request made. The item is recorded as fetched once the caller is done
+        with a successful response, failed and skipped items keep their staleness.
+        """
+        key = key or (lambda entity: entity)
+        endpoint = SKIP_ENDPOINTS[stage]
+        limiter = RateLimiter(interval)
+
+        def fetch(entity):
+            if self.skip_index is not None and self.skip_index.should_skip(endpoint, key(entity)):
+                return None, None
+            entity_url = url.format(**entity) if isinstance(entity, dict) else url.format(entity)
+            return self._get_json(entity_url, endpoint, key(entity), limiter)
+
+        items = self.scheduler.iterate(stage, entities, key)
+        for entity, (status, response), duration in self.pipeline.run(items, fetch):
+            yield entity, response
+            if status is None:
+                continue
+            succeeded = response is not None and ('value' in response or 'enabled' in response)
+            if succeeded:
+                self.fetched_ids.setdefault(stage, []).append(key(entity))
+            self.scheduler.record(stage, key(entity), duration, succeeded)
+
+    def write_skip_index(self):
+        if self.skip_index is None:
+            return
+        for endpoint, count in self.skip_index.skipped.items():
+            logging.info(f"{endpoint}: {count} requests saved by skipping inaccessible or empty entities")
+        self.state['skip_index'] = self.skip_index.to_state()
+
+    def _project_columns(self, table, keys):
+        """
+        Returns the columns selected for the table in the configuration and sets them to the manifest.
+        Primary key columns are always kept, tables not configured keep all columns.
+        """
+        selected = self.table_columns.get(table.name.replace('.csv', ''))
+        if not selected:
+            return keys
+
+        columns = [column for column in keys if column in selected or column in (table.primary_key or [])]
+        table.columns = columns
+        return columns
+
+    def _write_manifest(self, table):
+        if table.name not in self.disabled_tables:
+            self.write_manifest(table)
+
+    def _init_table(self, table, columns):
+        """
+        Creates empty output table. With sliced output the table is a folder of gzip compressed slices
+        without header, the columns are defined by the manifest.
+        """
+        self.table_stages[table.name] = (table, self.current_stage)
+        if table.name in self.disabled_tables:
+            return
+
+        if self.sliced_output:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=COMPRESSION_THREADS)
+            table.is_sliced = True
+            self.writers[table.name] = SlicedTableWriter(table.full_path, self.executor)
+            return
+
+        pd = pandas.DataFrame(columns=columns)
+        pd.to_csv(table.full_path, columns=columns, index=False)
+
+    def _write_rows(self, table, to_write, columns):
+        """
+        Appends rows to the output table, rows with a primary key already written in this run are dropped.
+        With delta output enabled, rows of incremental tables that did not change since the last run are dropped too.
+        """
+        if self.lineage is not None and table.name in LINEAGE_TABLES:
+            self.lineage.add_rows(table.name, to_write.to_dict(orient='records'))
+
+        if table.name in self.disabled_tables:
+            if table.name in PARENT_TABLES:
+                self.parent_rows.setdefault(table.name, []).append(to_write)
+            return
+
+        if table.primary_key:
+            index = self.pk_indexes.setdefault(table.name, PrimaryKeyIndex())
+            snapshot = self._get_snapshot(table)
+            pk_positions = [columns.index(column) for column in table.primary_key]
+
+            unique = []
+            changed = []
+            for row in to_write[columns].itertuples(index=False, name=None):
+                pk = [row[position] for position in pk_positions]
+                is_unique = index.add(pk)
+                unique.append(is_unique)
+                changed.append(is_unique and (snapshot is None or snapshot.update(pk, row)))
+
+            if table.name in PARENT_TABLES:
+                self.parent_rows.setdefault(table.name, []).append(to_write.loc[unique])
+            to_write = to_write.loc[changed]
+
+        nested = [column for column in columns if column in NESTED_COLUMNS]
+        if nested:
+            to_write = to_write.assign(**{column: to_write[column].map(to_json) for column in nested})
+
+        if table.name in self.writers:
+            self.writers[table.name].write(to_write, columns)
+        else:
+            to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=columns)
+
+    def _get_snapshot(self, table):
+        if not (self.delta_output and table.incremental) or table.name in DELTA_EXCLUDED_TABLES:
+            return None
+        if self.snapshot_inputs is None:
+            self.snapshot_inputs = {file.name: file.full_path
+                                    for file in self.get_input_files_definitions(tags=[SNAPSHOT_TAG])}
+        if table.name not in self.snapshots:
+            path = self.snapshot_inputs.get(self._snapshot_name(table.name))
+            self.snapshots[table.name] = (table, RowSnapshot(path))
+        return self.snapshots[table.name][1]
+
+    @staticmethod
+    def _snapshot_name(table_name):
+        return table_name.replace('.csv', '.snapshot')
+
+    def _read_parent_table(self, name, usecols):
+        """
+        Returns rows of the parent table written in this run, so that delta output does not hide unchanged parents.
+        Falls back to the output file when the parent stage did not write anything.
+        """
+        if name in self.parent_rows:
+            return pandas.concat(self.parent_rows[name], ignore_index=True)[usecols]
+
+        if os.path.isdir(f"../data/out/tables/{name}"):
+            return pandas.DataFrame(columns=usecols)
+
+        with open(f"../data/out/tables/{name}") as f:
+            file_data = pandas.read_csv(f, usecols=usecols)
+            return pandas.DataFrame(file_data)
+
+    def close_writers(self):
+        for name, writer in self.writers.items():
+            writer.close()
+            logging.info(f"{name}: {writer.slices} compressed slices written")
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _is_complete(self, table):
+        stage = self.table_stages.get(table.name, (table, None))[1]
+        return stage not in self.scheduler.incomplete
+
+    def finish_incomplete_tables(self):
+        """
+        Full load tables of stages stopped by the runtime budget are loaded incrementally, replacing only the rows
+        of the entities fetched in this run, so that the rest of the storage keeps the data from the previous runs.
+        Tables without the entity column are not loaded.
+        """
+        for name, (table, stage) in self.table_stages.items():
+            if table.incremental or self._is_complete(table) or name in self.disabled_tables:
+                continue
+
+            parent_column = PARENT_COLUMNS.get(name)
+            fetched = self.fetched_ids.get(stage)
+            if fetched and parent_column in (table.columns or []):
+                logging.warning(f"{name}: stage {stage} did not finish within the runtime budget, "
+                                f"rows of {len(fetched)} fetched entities are replaced")
+                table.incremental = True
+                table.set_delete_where_from_dict({'column': parent_column, 'values': sorted(map(str, fetched)),
+                                                  'operator': 'eq'})
+                self._write_manifest(table)
+                continue
+
+            logging.warning(f"{name}: stage {stage} did not finish within the runtime budget, table is not loaded")
+            if os.path.isdir(table.full_path):
+                shutil.rmtree(table.full_path)
+            elif os.path.exists(table.full_path):
+                os.remove(table.full_path)
+            if os.path.exists(table.full_path + '.manifest'):
+                os.remove(table.full_path + '.manifest')
+
+    def write_lineage(self):
+        """
+        Writes edges of the lineage nodes that changed in this run and the transitive closure of all nodes depending
+        on them. Rows of the recomputed nodes are replaced in the storage using delete_where on source_id.
+        """
+        if self.lineage is None:
+            return
+
+        complete = [name for name, (table, _) in self.table_stages.items()
+                    if name in LINEAGE_TABLES and self._is_complete(table)]
+        self.state['lineage'], changed_edges, closure = self.lineage.finish(complete)
+
+        edges = []
+        for node, node_edges in changed_edges.items():
+            for edge in node_edges:
+                relation, target = edge.split('>', 1)
+                edges.append([*split_node(node), relation, *split_node(target)])
+
+        ancestors = []
+        for node, depths in closure.items():
+            for ancestor, depth in depths.items():
+                ancestors.append([*split_node(node), *split_node(ancestor), depth])
+
+        keys_edges = ["source_type", "source_id", "relation", "target_type", "target_id"]
+        self._write_lineage_table('pbi_lineage_edges.csv', keys_edges, keys_edges, edges, changed_edges)
+
+        keys_closure = ["source_type", "source_id", "ancestor_type", "ancestor_id", "depth"]
+        self._write_lineage_table('pbi_lineage_closure.csv', keys_closure, keys_closure[:4], ancestors, closure)
+
+        logging.info(f"Lineage: {len(changed_edges)} nodes changed, closure of {len(closure)} nodes recomputed")
+
+    def _write_lineage_table(self, name, keys, primary_key, rows, sources):
+        delete_where = None
+        if not self.lineage.full and sources:
+            delete_where = {'column': 'source_id', 'values': sorted({split_node(node)[1] for node in sources}),
+                            'operator': 'eq'}
+
+        table = self.create_out_table_definition(name, incremental=not self.lineage.full, columns=keys,
+                                                 primary_key=primary_key, delete_where=delete_where)
+
+        self._write_manifest(table)
+        logging.info(table.full_path)
+
+        self._init_table(table, keys)
+        self._write_rows(table, pandas.DataFrame(rows, columns=keys), keys)
+
+    def write_refresh_stats(self):
+        """
+        Writes refresh statistics of all datasets kept in the state, updated with the refreshes seen in this run.
+        Datasets no longer listed are dropped once the datasets stage has fully run.
+        """
+        if self.refresh_stats is None or 'pbi_datasets_refreshes.csv' not in self.table_stages:
+            return
+
+        datasets = self.table_stages.get('pbi_datasets.csv')
+        if datasets is not None and self._is_complete(datasets[0]):
+            rows = self.parent_rows.get('pbi_datasets.csv')
+            self.refresh_stats.prune(set(pandas.concat(rows)['id']) if rows else set())
+        self.state['refresh_stats'] = self.refresh_stats.to_state()
+
+        keys = ["dataset_id", "group_id", "refreshes", "completed", "failed", "failure_rate", "duration_mean",
+                "duration_p50", "duration_p90", "duration_p99", "last_refresh_time", "last_status",
+                "last_success_time"]
+        table = self.create_out_table_definition('pbi_datasets_refresh_stats.csv', incremental=self.incremental,
+                                                 columns=keys,
+                                                 primary_key=['dataset_id'])
+        projected = self._project_columns(table, keys)
+
+        self._write_manifest(table)
+        logging.info(table.full_path)
+
+        self._init_table(table, projected)
+        self._write_rows(table, pandas.DataFrame(self.refresh_stats.rows(), columns=keys), projected)
+        logging.info(f"Refresh statistics of {len(self.refresh_stats)} datasets written")
+
+    def _needed_stages(self):
+        """
+        Returns the stages to run in dependency order. A stage whose tables are all disabled is not needed,
+        unless a following stage needs its rows or the lineage is built from its tables.
+        """
+        lineage_tables = set(LINEAGE_TABLES) if self.lineage is not None else set()
+        needed = set()
+        for stage in reversed(list(STAGE_PARENTS)):
+            tables = STAGE_TABLES[stage]
+            if stage in needed or not self.disabled_tables.issuperset(tables) or lineage_tables.intersection(tables):
+                needed.update(filter(None, [stage, STAGE_PARENTS[stage]]))
+            else:
+                logging.info(f"Stage {stage} skipped, all its tables are disabled")
+
+        return [stage for stage in STAGE_PARENTS if stage in needed]
+
+    def run_stages(self):
+        """
+        Runs extraction stages, the stage with carried over work or the least recently finished one goes first
+        once its parent stage has run, parent stages inherit the priority of their descendants. Each stage gets
+        an equal share of the remaining budget, a stage cut short carries its items over and its descendants run
+        with the entities fetched so far. Stops when the runtime budget is exhausted, the stages not started
+        are carried over to the next run.
+        """
+        pending = self._needed_stages()
+        while pending:
+            ready = [stage for stage in pending if STAGE_PARENTS[stage] not in pending]
+            stage = min(ready, key=lambda ready_stage: self.scheduler.stage_priority(
+                ready_stage, _descendants(ready_stage, pending)))
+            self.scheduler.start_stage(len(pending) - 1)
+            if self.scheduler.out_of_time(stage):
+                break
+
+            pending.remove(stage)
+            self.current_stage = stage
+            started = time.monotonic()
+            getattr(self, f"get_pbi_{stage}")()
+
+            if STAGE_PARENTS[stage] in self.scheduler.incomplete:
+                self.scheduler.incomplete.add(stage)
+            self.scheduler.finish_stage(stage, time.monotonic() - started)
+
+        self.current_stage = None
+        for stage in pending:
+            logging.warning(f"Stage {stage} skipped, runtime budget exhausted")
+            self.scheduler.skip_stage(stage)
+
+        self.state['scheduler'] = self.scheduler.to_state()
+
+    def write_counts(self):
+        """
+        Keeps the entity counts of the stages finished in this run for the plan action.
+        """
+        counts = self.state.setdefault('counts', {})
+        parents = [('groups', 'pbi_groups.csv'), ('datasets', 'pbi_datasets.csv'), ('gateways', 'pbi_gateways.csv')]
+        for key, name in parents:
+            if name not in self.table_stages or not self._is_complete(self.table_stages[name][0]):
+                continue
+
+            rows = self.parent_rows.get(name)
+            if not rows:
+                counts[key] = 0
+                continue
+
+            rows = pandas.concat(rows, ignore_index=True).drop_duplicates(subset=['id'])
+            counts[key] = len(rows)
+            if key == 'datasets':
+                counts['refreshable_datasets'] = sum(1 for value in rows['is_refreshable'] if value == value and value)
+
+    def write_snapshots(self):
+        """
+        Writes row snapshots of the delta output tables as files tagged with SNAPSHOT_TAG, snapshots of tables
+        not written in this run stay in the storage from the previous runs.
+        """
+        # snapshots used to be kept in the state file
+        self.state.pop('snapshots', None)
+        for name, (table, snapshot) in self.snapshots.items():
+            file = self.create_out_file_definition(self._snapshot_name(name), tags=[SNAPSHOT_TAG])
+            deleted = snapshot.finish(file.full_path, complete=self._is_complete(table))
+            self.write_manifest(file)
+            logging.info(f"{name}: {snapshot.inserted} inserted, {snapshot.changed} changed, "
+                         f"{snapshot.unchanged} unchanged rows skipped, {snapshot.deleted} deleted")
+
+            if self.deleted_rows and deleted and name not in DELETES_EXCLUDED_TABLES:
+                self.write_deleted_rows(table, deleted)
+
+    def write_deleted_rows(self, table, deleted):
+        keys = table.primary_key
+        table_deleted = self.create_out_table_definition(table.name.replace('.csv', '_deleted.csv'), incremental=True,
+                                                         columns=keys, primary_key=keys)
+
+        self.write_manifest(table_deleted)
+        logging.info(table_deleted.full_path)
+
+        to_write = pandas.DataFrame(deleted, columns=keys)
+        to_write.to_csv(table_deleted.full_path, columns=keys, index=False)
+
+    def log_duplicates(self):
+        for name, index in self.pk_indexes.items():
+            logging.info(f"{name}: {len(index)} unique rows written, {index.duplicates} duplicate rows dropped")
+
     def get_pbi_groups(self):
         key = ["id", "name"]
         key_refresh = ["id", "isReadOnly", "isOnDedicatedCapacity", "name", "type"]
 
         table = self.create_out_table_definition('pbi_groups.csv', incremental=self.incremental,
                                                  columns=key, primary_key=['name', 'id'])
+        key = self._project_columns(table, key)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
         table_refresh = self.create_out_table_definition('pbi_groups_refresh.csv', incremental=False,
                                                          columns=key_refresh)
+        key_refresh = self._project_columns(table_refresh, key_refresh)
 
         out_table_refresh_path = table_refresh.full_path
         logging.info(out_table_refresh_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=key)
-            pd.to_csv(out_table_path, columns=key, index=False)
+        self._init_table(table, key)
 
-        with open(out_table_refresh_path, "w"):
-            pd = pandas.DataFrame(columns=key_refresh)
-            pd.to_csv(out_table_refresh_path, columns=key_refresh, index=False)
+        self._init_table(table_refresh, key_refresh)
 
         url = "https://api.powerbi.com/v1.0/myorg/groups"
         headers = {
@@ -102,13 +655,13 @@ class Component(ComponentBase):
         }
 
         to_write = pandas.DataFrame.from_dict(new_items)
-        to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=key)
+        self._write_rows(table, to_write, key)
 
         to_write_refresh = pandas.DataFrame.from_dict(new_items_refresh)
-        to_write_refresh.to_csv(table_refresh.full_path, mode="a", header=False, index=False, columns=key_refresh)
+        self._write_rows(table_refresh, to_write_refresh, key_refresh)
 
-        self.write_manifest(table)
-        self.write_manifest(table_refresh)
+        self._write_manifest(table)
+        self._write_manifest(table_refresh)
 
     def get_pbi_users(self):
         keys = [
@@ -122,26 +675,20 @@ class Component(ComponentBase):
 
         table = self.create_out_table_definition('pbi_users.csv', incremental=self.incremental, columns=keys,
                                                  primary_key=['email', 'group_user_access_right', 'groups_id_parent'])
+        keys = self._project_columns(table, keys)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
-        with open("../data/out/tables/pbi_groups.csv") as f:
-            file_data = pandas.read_csv(f)
-            pd = pandas.DataFrame(file_data)
-            group_id_total = pd["id"].to_list()
-
-        for groupId in group_id_total:
-            url = f"https://api.powerbi.com/v1.0/myorg/groups/{groupId}/users"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
+        pd = self._read_parent_table("pbi_groups.csv", usecols=['id'])
+        group_id_total = pd["id"].to_list()
 
-            response = requests.get(url, headers=headers).json()
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{}/users"
+        for groupId, response in self._fetch_stage("users", group_id_total, url):
+            if response is None:
+                continue
             pd = pandas.DataFrame.from_dict(response["value"])
             new_items = {
                 "email": pd.get('emailAddress'),
@@ -154,9 +701,9 @@ class Component(ComponentBase):
 
             to_write = pandas.DataFrame.from_dict(new_items)
             # print(to_write)
-            to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+            self._write_rows(table, to_write, keys)
 
-            self.write_manifest(table)
+            self._write_manifest(table)
 
     def get_pbi_datasets(self):
         # Create output table (Table-definition - just metadata)
@@ -174,15 +721,14 @@ class Component(ComponentBase):
 
         table = self.create_out_table_definition('pbi_datasets.csv', incremental=self.incremental, columns=keys,
                                                  primary_key=['name', 'id'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
         keys_refresh = ["id",
                         "name",
@@ -205,27 +751,22 @@ class Component(ComponentBase):
 
         table_refresh = self.create_out_table_definition('pbi_datasets_refresh.csv', incremental=False,
                                                          columns=keys_refresh)
+        keys_refresh = self._project_columns(table_refresh, keys_refresh)
 
-        self.write_manifest(table_refresh)
+        self._write_manifest(table_refresh)
 
         out_table_refresh_path = table_refresh.full_path
         logging.info(out_table_refresh_path)
 
-        with open(out_table_refresh_path, "w"):
-            pd = pandas.DataFrame(columns=keys_refresh)
-            pd.to_csv(out_table_refresh_path, columns=keys_refresh, index=False)
+        self._init_table(table_refresh, keys_refresh)
 
-        with open("../data/out/tables/pbi_groups.csv") as f:
-            file_data = pandas.read_csv(f)
-            pd = pandas.DataFrame(file_data)
-            group_id_total = pd["id"].to_list()
+        pd = self._read_parent_table("pbi_groups.csv", usecols=['id'])
+        group_id_total = pd["id"].to_list()
 
-        for groupId in group_id_total:
-            url = f"https://api.powerbi.com/v1.0/myorg/groups/{groupId}/datasets"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
-            response = requests.get(url, headers=headers).json()
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{}/datasets"
+        for groupId, response in self._fetch_stage("datasets", group_id_total, url):
+            if response is None:
+                continue
             pd = pandas.DataFrame.from_dict(response["value"])
 
             if not pd.empty:
@@ -266,11 +807,10 @@ class Component(ComponentBase):
                     pass
                 else:
                     to_write = pandas.DataFrame.from_dict(new_items)
-                    to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                    self._write_rows(table, to_write, keys)
 
                     to_write_refresh = pandas.DataFrame.from_dict(new_items_refresh)
-                    to_write_refresh.to_csv(table_refresh.full_path, mode="a", header=False, index=False,
-                                            columns=keys_refresh)
+                    self._write_rows(table_refresh, to_write_refresh, keys_refresh)
 
     def get_pbi_dashboards(self):
         keys = [
@@ -283,8 +823,9 @@ class Component(ComponentBase):
         ]
         table = self.create_out_table_definition('pbi_dashboards.csv', incremental=self.incremental, columns=keys,
                                                  primary_key=['id'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
@@ -301,31 +842,23 @@ class Component(ComponentBase):
         ]
         table_refresh = self.create_out_table_definition('pbi_dashboards_refresh.csv', incremental=False,
                                                          columns=keys_refresh)
+        keys_refresh = self._project_columns(table_refresh, keys_refresh)
 
-        self.write_manifest(table_refresh)
+        self._write_manifest(table_refresh)
         out_table_refresh_path = table_refresh.full_path
         logging.info(out_table_refresh_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
-
-        with open(out_table_refresh_path, "w"):
-            pd = pandas.DataFrame(columns=keys_refresh)
-            pd.to_csv(out_table_refresh_path, columns=keys_refresh, index=False)
+        self._init_table(table, keys)
 
-        with open("../data/out/tables/pbi_groups.csv") as f:
-            file_data = pandas.read_csv(f)
-            pd = pandas.DataFrame(file_data)
-            group_id_total = pd["id"].to_list()
+        self._init_table(table_refresh, keys_refresh)
 
-        for groupId in group_id_total:
-            url = f"https://api.powerbi.com/v1.0/myorg/groups/{groupId}/dashboards"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
+        pd = self._read_parent_table("pbi_groups.csv", usecols=['id'])
+        group_id_total = pd["id"].to_list()
 
-            response = requests.get(url, headers=headers).json()
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{}/dashboards"
+        for groupId, response in self._fetch_stage("dashboards", group_id_total, url):
+            if response is None:
+                continue
 
             pd = pandas.DataFrame.from_dict(response["value"])
 
@@ -353,11 +886,10 @@ class Component(ComponentBase):
                     pass
                 else:
                     to_write = pandas.DataFrame.from_dict(new_items)
-                    to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                    self._write_rows(table, to_write, keys)
 
                     to_write_refresh = pandas.DataFrame.from_dict(new_items_refresh)
-                    to_write_refresh.to_csv(table_refresh.full_path, mode="a", header=False, index=False,
-                                            columns=keys_refresh)
+                    self._write_rows(table_refresh, to_write_refresh, keys_refresh)
 
     def get_pbi_reports(self):
         keys = [
@@ -373,15 +905,14 @@ class Component(ComponentBase):
         ]
         table = self.create_out_table_definition('pbi_reports.csv', incremental=self.incremental, columns=keys,
                                                  primary_key=['id'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
         keys_actual = [
             "id",
@@ -399,28 +930,22 @@ class Component(ComponentBase):
         ]
         table_actual = self.create_out_table_definition('pbi_reports_actual.csv', incremental=self.incremental,
                                                         columns=keys_actual)
+        keys_actual = self._project_columns(table_actual, keys_actual)
 
-        self.write_manifest(table_actual)
+        self._write_manifest(table_actual)
 
         out_table_actual_path = table_actual.full_path
         logging.info(out_table_actual_path)
 
-        with open(out_table_actual_path, "w"):
-            pd = pandas.DataFrame(columns=keys_actual)
-            pd.to_csv(out_table_actual_path, columns=keys_actual, index=False)
+        self._init_table(table_actual, keys_actual)
 
-        with open("../data/out/tables/pbi_groups.csv") as f:
-            file_data = pandas.read_csv(f)
-            pd = pandas.DataFrame(file_data)
-            group_id_total = pd["id"].to_list()
+        pd = self._read_parent_table("pbi_groups.csv", usecols=['id'])
+        group_id_total = pd["id"].to_list()
 
-        for groupId in group_id_total:
-            url = f"https://api.powerbi.com/v1.0/myorg/groups/{groupId}/reports"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
-
-            response = requests.get(url, headers=headers).json()
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{}/reports"
+        for groupId, response in self._fetch_stage("reports", group_id_total, url):
+            if response is None:
+                continue
 
             pd = pandas.DataFrame.from_dict(response["value"])
 
@@ -455,11 +980,10 @@ class Component(ComponentBase):
                     pass
                 else:
                     to_write = pandas.DataFrame.from_dict(new_items)
-                    to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                    self._write_rows(table, to_write, keys)
 
                     to_write_actual = pandas.DataFrame.from_dict(new_items_actual)
-                    to_write_actual.to_csv(table_actual.full_path, mode="a", header=False, index=False,
-                                           columns=keys_actual)
+                    self._write_rows(table_actual, to_write_actual, keys_actual)
 
     def get_pbi_gateways(self):
         keys = [
@@ -473,15 +997,14 @@ class Component(ComponentBase):
         ]
         table = self.create_out_table_definition('pbi_gateways.csv', incremental=self.incremental, columns=keys,
                                                  primary_key=['id', 'name', 'type', 'public_key_modulus'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
         url = "https://api.powerbi.com/v1.0/myorg/gateways"
         headers = {
@@ -509,7 +1032,7 @@ class Component(ComponentBase):
             else:
                 to_write = pandas.DataFrame.from_dict(new_items)
                 # print(to_write)
-                to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                self._write_rows(table, to_write, keys)
 
     def get_pbi_datasources_gateway(self):
         keys = [
@@ -524,28 +1047,22 @@ class Component(ComponentBase):
         table = self.create_out_table_definition('pbi_datasources_gateway.csv', incremental=self.incremental,
                                                  columns=keys,
                                                  primary_key=['id'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
-
-        with open("../data/out/tables/pbi_gateways.csv") as f:
-            file_data = pandas.read_csv(f)
-            pd = pandas.DataFrame(file_data)
-            group_id_total = pd["id"].to_list()
+        self._init_table(table, keys)
 
-        for gatewayId in group_id_total:
-            url = f"https://api.powerbi.com/v1.0/myorg/gateways/{gatewayId}/datasources"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
+        pd = self._read_parent_table("pbi_gateways.csv", usecols=['id'])
+        group_id_total = pd["id"].to_list()
 
-            response = requests.get(url, headers=headers).json()
+        url = "https://api.powerbi.com/v1.0/myorg/gateways/{}/datasources"
+        for gatewayId, response in self._fetch_stage("datasources_gateway", group_id_total, url):
+            if response is None:
+                continue
             # print(response)
             pd = pandas.DataFrame.from_dict(response["value"])
             credential_details = pd.get('credentialDetails')
@@ -566,7 +1083,7 @@ class Component(ComponentBase):
                 else:
                     to_write = pandas.DataFrame.from_dict(new_items)
                     # print(to_write)
-                    to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                    self._write_rows(table, to_write, keys)
 
     def get_pbi_datasets_refreshes(self):
         keys = [
@@ -583,73 +1100,72 @@ class Component(ComponentBase):
                                                  columns=keys,
                                                  primary_key=['id', 'start_time', 'end_time', 'dataset_id_parent',
                                                               'request_id', 'refresh_type'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
-        with open("../data/out/tables/pbi_datasets.csv") as f:
-            file_data = pandas.read_csv(f, usecols=['id', 'group_id_parent', 'is_refreshable'])
-            pd = pandas.DataFrame(file_data)
+        pd = self._read_parent_table("pbi_datasets.csv", usecols=['id', 'group_id_parent', 'is_refreshable'])
+        group_dataset_all = pd.to_dict(orient='records')
 
-            group_dataset_all = pd.to_dict(orient='records')
+        refreshable = [dataset for dataset in group_dataset_all if dataset['is_refreshable']]
 
-        for key in range(len(group_dataset_all)):
-            time.sleep(0.5)
-            group_id = group_dataset_all[key]['group_id_parent']
-            dataset_id = group_dataset_all[key]['id']
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{group_id_parent}/datasets/{id}/refreshes"
+        for dataset, response in self._fetch_stage("datasets_refreshes", refreshable, url, key=itemgetter('id'),
+                                                   interval=0.5):
+            group_id = dataset['group_id_parent']
+            dataset_id = dataset['id']
 
-            if group_dataset_all[key]['is_refreshable']:
+            if response is None:
+                continue
 
-                url = f"https://api.powerbi.com/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/refreshes"
-                headers = {
-                    "Authorization": f"Bearer {self.access_token}"
-                }
+            if response.get('value'):
+                self.state.setdefault('refresh_status', {})[dataset_id] = refresh_state(group_id,
+                                                                                        response['value'][0])
+                if self.refresh_stats is not None:
+                    self.refresh_stats.update(dataset_id, group_id, response['value'])
 
-                response = requests.get(url, headers=headers).json()
+            # print("pbi_datasets_refreshes:")
+            # print(f"datasetID: {dataset_id}")
+            # print(f"groupID: {group_id}")
+            # print(response)
 
-                # print("pbi_datasets_refreshes:")
-                # print(f"datasetID: {dataset_id}")
-                # print(f"groupID: {group_id}")
-                # print(response)
+            try:
+                pd = pandas.DataFrame.from_dict(response["value"])
+                if not pd.empty:
 
-                try:
-                    pd = pandas.DataFrame.from_dict(response["value"])
-                    if not pd.empty:
-
-                        try:
-                            new_items = {
-                                "id": pd.get('id'),
-                                "start_time": pd.get('startTime'),
-                                "end_time": pd.get('endTime'),
-                                "status": pd.get('status'),
-                                "service_exception_json": pd.get('serviceExceptionJson'),
-                                "dataset_id_parent": dataset_id,
-                                "request_id": pd.get('requestId'),
-                                "refresh_type": pd.get('refreshType')
-                            }
-
-                        except AttributeError:
-                            if len(pd) != 0:
-                                print("pbi_datasets_refreshes - AttributeError:")
-                                print(f"datasetID: {dataset_id}")
-                                print(f"groupID: {group_id}")
-                                print(response)
-                            pass
-                        else:
-                            to_write = pandas.DataFrame.from_dict(new_items)
-                            # print(to_write)
-                            to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
-                except KeyError:
-                    print("pbi_datasets_refreshes - KeyError:")
-                    print(f"datasetID: {dataset_id}")
-                    print(f"groupID: {group_id}")
-                    pass
+                    try:
+                        new_items = {
+                            "id": pd.get('id'),
+                            "start_time": pd.get('startTime'),
+                            "end_time": pd.get('endTime'),
+                            "status": pd.get('status'),
+                            "service_exception_json": pd.get('serviceExceptionJson'),
+                            "dataset_id_parent": dataset_id,
+                            "request_id": pd.get('requestId'),
+                            "refresh_type": pd.get('refreshType')
+                        }
+
+                    except AttributeError:
+                        if len(pd) != 0:
+                            print("pbi_datasets_refreshes - AttributeError:")
+                            print(f"datasetID: {dataset_id}")
+                            print(f"groupID: {group_id}")
+                            print(response)
+                        pass
+                    else:
+                        to_write = pandas.DataFrame.from_dict(new_items)
+                        # print(to_write)
+                        self._write_rows(table, to_write, keys)
+            except KeyError:
+                print("pbi_datasets_refreshes - KeyError:")
+                print(f"datasetID: {dataset_id}")
+                print(f"groupID: {group_id}")
+                pass
 
     def get_pbi_datasets_datasources(self):
         keys = [
@@ -670,31 +1186,25 @@ class Component(ComponentBase):
                                                  columns=keys,
                                                  primary_key=['datasource_id', 'gateway_id', 'name',
                                                               'dataset_id_parent'])
+        keys = self._project_columns(table, keys)
 
-        self.write_manifest(table)
+        self._write_manifest(table)
 
         out_table_path = table.full_path
         logging.info(out_table_path)
 
-        with open(out_table_path, "w"):
-            pd = pandas.DataFrame(columns=keys)
-            pd.to_csv(out_table_path, columns=keys, index=False)
+        self._init_table(table, keys)
 
-        with open("../data/out/tables/pbi_datasets.csv") as f:
-            file_data = pandas.read_csv(f, usecols=['id', 'group_id_parent', 'is_refreshable'])
-            pd = pandas.DataFrame(file_data)
-            group_dataset_all = pd.to_dict(orient='records')
+        pd = self._read_parent_table("pbi_datasets.csv", usecols=['id', 'group_id_parent', 'is_refreshable'])
+        group_dataset_all = pd.to_dict(orient='records')
 
-        for key in range(len(group_dataset_all)):
-            group_id = group_dataset_all[key]['group_id_parent']
-            dataset_id = group_dataset_all[key]['id']
-
-            url = f"https://api.powerbi.com/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/datasources"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{group_id_parent}/datasets/{id}/datasources"
+        for dataset, response in self._fetch_stage("datasets_datasources", group_dataset_all, url,
+                                                   key=itemgetter('id')):
+            dataset_id = dataset['id']
 
-            response = requests.get(url, headers=headers).json()
+            if response is None:
+                continue
             # print(url)
             # print(response)
             try:
@@ -744,7 +1254,7 @@ class Component(ComponentBase):
 
                     to_write = pandas.DataFrame(new_items, index=[0])
                     # print(to_write)
-                    to_write.to_csv(table.full_path, mode="a", header=False, index=False, columns=keys)
+                    self._write_rows(table, to_write, keys)
 
     def get_pbi_datasets_refresh_schedule(self):
         keys = ["data", "parent_id"]
@@ -753,20 +1263,23 @@ class Component(ComponentBase):
                                                        incremental=False,
                                                        columns=keys,
                                                        primary_key=[])
+        keys_times = self._project_columns(table_times, keys)
 
         table_days = self.create_out_table_definition('pbi_datasets_refresh_schedule_days.csv',
                                                       incremental=False,
                                                       columns=keys,
                                                       primary_key=[])
+        keys_days = self._project_columns(table_days, keys)
 
         table_enable = self.create_out_table_definition('pbi_datasets_refresh_schedule_enable.csv',
                                                         incremental=False,
                                                         columns=keys,
                                                         primary_key=[])
+        keys_enable = self._project_columns(table_enable, keys)
 
-        self.write_manifest(table_times)
-        self.write_manifest(table_days)
-        self.write_manifest(table_enable)
+        self._write_manifest(table_times)
+        self._write_manifest(table_days)
+        self._write_manifest(table_enable)
 
         out_table_times_path = table_times.full_path
         out_table_days_path = table_days.full_path
@@ -775,72 +1288,69 @@ class Component(ComponentBase):
         logging.info(out_table_days_path)
         logging.info(out_table_enable_path)
 
-        with open(out_table_times_path, "w"):
-            pd_times = pandas.DataFrame(columns=keys)
-            pd_times.to_csv(out_table_times_path, columns=keys, index=False)
+        self._init_table(table_times, keys_times)
 
-        with open(out_table_days_path, "w"):
-            pd_days = pandas.DataFrame(columns=keys)
-            pd_days.to_csv(out_table_days_path, columns=keys, index=False)
+        self._init_table(table_days, keys_days)
 
-        with open(out_table_enable_path, "w"):
-            pd_enable = pandas.DataFrame(columns=keys)
-            pd_enable.to_csv(out_table_enable_path, columns=keys, index=False)
+        self._init_table(table_enable, keys_enable)
 
-        with open("../data/out/tables/pbi_datasets.csv") as f:
-            file_data = pandas.read_csv(f, usecols=['id', 'group_id_parent', 'is_refreshable'])
-            pd_times = pandas.DataFrame(file_data)
-            group_dataset_all = pd_times.to_dict(orient='records')
+        pd_times = self._read_parent_table("pbi_datasets.csv", usecols=['id', 'group_id_parent', 'is_refreshable'])
+        group_dataset_all = pd_times.to_dict(orient='records')
 
-        for key in range(len(group_dataset_all)):
-            group_id = group_dataset_all[key]['group_id_parent']
-            dataset_id = group_dataset_all[key]['id']
+        refreshable = [dataset for dataset in group_dataset_all if dataset['is_refreshable']]
 
-            if group_dataset_all[key]['is_refreshable']:
-                url = f"https://api.powerbi.com/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/refreshSchedule"
-                headers = {
-                    "Authorization": f"Bearer {self.access_token}"
-                }
+        url = "https://api.powerbi.com/v1.0/myorg/groups/{group_id_parent}/datasets/{id}/refreshSchedule"
+        for dataset, response in self._fetch_stage("datasets_refresh_schedule", refreshable, url,
+                                                   key=itemgetter('id')):
+            group_id = dataset['group_id_parent']
+            dataset_id = dataset['id']
 
-                response = requests.get(url, headers=headers).json()
+            if response is None:
+                continue
 
-                try:
-                    pd_times = pandas.Series(response['times'], dtype='object')
-                    pd_days = pandas.Series(response['days'], dtype='object')
-                    refresh_enabled = response.get('enabled')
+            schedules = self.state.setdefault('refresh_schedules', {})
+            if response.get('enabled'):
+                schedules[dataset_id] = refresh_schedule(group_id, response)
+            else:
+                schedules.pop(dataset_id, None)
 
-                except AttributeError:
-                    pass
-                else:
+            try:
+                pd_times = pandas.Series(response['times'], dtype='object')
+                pd_days = pandas.Series(response['days'], dtype='object')
+                refresh_enabled = response.get('enabled')
 
-                    if not pd_times.empty:
-                        for _ in range(len(pd_times)):
-                            new_items = {
-                                "data": pd_times[_],
-                                "parent_id": dataset_id
-                            }
-                            to_write = pandas.DataFrame(new_items, index=[0])
-                            # print(to_write)
-                            to_write.to_csv(table_times.full_path, mode="a", header=False, index=False, columns=keys)
-
-                    if not pd_days.empty:
-                        for _ in range(len(pd_days)):
-                            new_items = {
-                                "data": pd_days[_],
-                                "parent_id": dataset_id
-                            }
-                            to_write = pandas.DataFrame(new_items, index=[0])
-                            # print(to_write)
-                            to_write.to_csv(table_days.full_path, mode="a", header=False, index=False, columns=keys)
-
-                    if refresh_enabled:
+            except AttributeError:
+                pass
+            else:
+
+                if not pd_times.empty:
+                    for _ in range(len(pd_times)):
+                        new_items = {
+                            "data": pd_times[_],
+                            "parent_id": dataset_id
+                        }
+                        to_write = pandas.DataFrame(new_items, index=[0])
+                        # print(to_write)
+                        self._write_rows(table_times, to_write, keys_times)
+
+                if not pd_days.empty:
+                    for _ in range(len(pd_days)):
                         new_items = {
-                            "data": refresh_enabled,
+                            "data": pd_days[_],
                             "parent_id": dataset_id
                         }
                         to_write = pandas.DataFrame(new_items, index=[0])
                         # print(to_write)
-                        to_write.to_csv(table_enable.full_path, mode="a", header=False, index=False, columns=keys)
+                        self._write_rows(table_days, to_write, keys_days)
+
+                if refresh_enabled:
+                    new_items = {
+                        "data": refresh_enabled,
+                        "parent_id": dataset_id
+                    }
+                    to_write = pandas.DataFrame(new_items, index=[0])
+                    # print(to_write)
+                    self._write_rows(table_enable, to_write, keys_enable)
 
     def run(self):
         """
@@ -852,16 +1362,152 @@ class Component(ComponentBase):
 
         logging.info(f"Incremental = {self.incremental}")
 
-        # self.get_pbi_groups()
-        # self.get_pbi_users()
-        # self.get_pbi_datasets()
-        # self.get_pbi_dashboards()
-        # self.get_pbi_reports()
-        self.get_pbi_gateways()
-        # self.get_pbi_datasources_gateway()
-        # self.get_pbi_datasets_refreshes()
-        # self.get_pbi_datasets_datasources()
-        # self.get_pbi_datasets_refresh_schedule()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as fetch_executor:
+            self.pipeline = FetchPipeline(fetch_executor, 2 * self.concurrency)
+            self.run_stages()
+        self.write_lineage()
+        self.write_refresh_stats()
+
+        self.close_writers()
+        self.finish_incomplete_tables()
+        self.log_duplicates()
+        self.write_counts()
+        self.write_snapshots()
+        self.write_skip_index()
+        self.write_state_file(self.state)
+
+    def monitor(self):
+        """
+        Long running action polling the latest refresh of datasets with a refresh in progress or due
+        by the refresh schedule. Status transitions are appended to the output table as they are observed.
+        """
+        self.validate_configuration_parameters(REQUIRED_PARAMETERS)
+
+        keys = [
+            "dataset_id",
+            "group_id",
+            "refresh_id",
+            "request_id",
+            "refresh_type",
+            "previous_status",
+            "status",
+            "start_time",
+            "end_time",
+            "observed_at"
+        ]
+        table = self.create_out_table_definition('pbi_datasets_refresh_transitions.csv', incremental=True,
+                                                 columns=keys, primary_key=['dataset_id', 'refresh_id', 'status'])
+
+        self._write_manifest(table)
+        logging.info(table.full_path)
+
+        self._init_table(table, keys)
+
+        refresh_monitor = RefreshMonitor(self.state.setdefault('refresh_status', {}),
+                                         self.state.setdefault('refresh_schedules', {}))
+        deadline = time.monotonic() + (self.configuration.parameters.get(KEY_MAX_RUNTIME) or MONITOR_RUNTIME)
+        polls = 0
+        transitions = 0
+        failures = 0
+        throttled_until = 0
+
+        while time.monotonic() < deadline:
+            now = time.time()
+            refresh_monitor.update_tracking(now)
+
+            for dataset_id in refresh_monitor.due(now) if now >= throttled_until else []:
+                group_id = refresh_monitor.group_id(dataset_id)
+                url = f"https://api.powerbi.com/v1.0/myorg/groups/{group_id}/datasets/{dataset_id}/refreshes?$top=1"
+                headers = {
+                    "Authorization": f"Bearer {self.access_token}"
+                }
+
+                polls += 1
+                try:
+                    response = requests.get(url, headers=headers)
+                    if 'TokenExpired' in response.text:
+                        self.get_api_token()
+                        continue
+                    if response.status_code in SKIPPED_STATUS_CODES:
+                        refresh_monitor.forget(dataset_id)
+                        continue
+                    if response.status_code == 429:
+                        throttled_until = time.time() + retry_after(response.headers.get('Retry-After'), time.time())
+                        logging.warning(f"Throttled, polling paused for {throttled_until - time.time():.0f} s")
+                        refresh_monitor.observe(dataset_id, None, throttled_until)
+                        break
+                    response.raise_for_status()
+                    refreshes = response.json().get('value') or [None]
+                except (requests.RequestException, ValueError) as e:
+                    # the dataset is polled again after a longer interval, the loop keeps running
+                    failures += 1
+                    logging.warning(f"Polling refreshes of dataset {dataset_id} failed: {e}")
+                    refresh_monitor.observe(dataset_id, None, time.time())
+                    continue
+
+                transition = refresh_monitor.observe(dataset_id, refreshes[0], time.time())
+                if transition:
+                    transitions += 1
+                    self._write_rows(table, pandas.DataFrame([transition]), keys)
+
+            next_poll = max(refresh_monitor.next_poll() or now + MONITOR_TRACKING_INTERVAL, throttled_until)
+            wait = min(next_poll, now + MONITOR_TRACKING_INTERVAL) - time.time()
+            time.sleep(max(0, min(wait, deadline - time.monotonic())))
+
+        logging.info(f"Monitor finished: {polls} polls, {failures} failed, {transitions} refresh status transitions, "
+                     f"{len(refresh_monitor)} datasets still tracked")
+
+        self.close_writers()
+        self.write_state_file(self.state)
+
+    def plan(self):
+        """
+        Dry run estimating requests and wall time of every stage from the entity counts and request latencies
+        of the previous runs. No per-entity requests are made, groups and gateways are listed only when
+        their counts are not known yet.
+        """
+        self.validate_configuration_parameters(REQUIRED_PARAMETERS)
+        params = self.configuration.parameters
+
+        counts = dict(self.state.get('counts', {}))
+        for key in ['groups', 'gateways']:
+            if key not in counts:
+                url = f"https://api.powerbi.com/v1.0/myorg/{key}"
+                headers = {
+                    "Authorization": f"Bearer {self.access_token}"
+                }
+                response = requests.get(url, headers=headers).json()
+                counts[key] = len(response.get('value', []))
+
+        skipped = {}
+        if self.skip_index is not None:
+            skipped = {stage: self.skip_index.count(endpoint) for stage, endpoint in SKIP_ENDPOINTS.items()}
+
+        stage_plans = [plan_stage(stage, counts, self.scheduler.latency, skipped, self.concurrency)
+                       for stage in self._needed_stages()]
+        summary = plan_summary(stage_plans, params.get(KEY_REQUESTS_PER_HOUR), params.get(KEY_MAX_RUNTIME))
+
+        for stage_plan in stage_plans:
+            logging.info(f"Stage {stage_plan['stage']}: {stage_plan['requests']} requests, "
+                         f"~{stage_plan['estimated_seconds']} s")
+        logging.info(f"Plan: {summary['requests']} requests, ~{summary['estimated_seconds']} s, "
+                     f"fits quota: {summary['fits_quota']}, fits runtime: {summary['fits_runtime']}")
+        if summary['unknown_stages']:
+            logging.warning(f"Entity counts not known yet for stages {summary['unknown_stages']}, "
+                            f"run the extraction once to get a complete plan")
+
+        keys = ["stage", "entities", "requests", "skipped_requests", "latency_seconds", "estimated_seconds"]
+        table = self.create_out_table_definition('pbi_plan.csv', incremental=False, columns=keys)
+
+        self.write_manifest(table)
+        logging.info(table.full_path)
+
+        total = {"stage": "total", "requests": summary['requests'], "estimated_seconds": summary['estimated_seconds']}
+        to_write = pandas.DataFrame(stage_plans + [total], columns=keys)
+        to_write = to_write.astype({"entities": "Int64", "requests": "Int64", "skipped_requests": "Int64"})
+        to_write.to_csv(table.full_path, columns=keys, index=False)
+
+        self.write_state_file(self.state)
 
 
 """
@@ -0,0 +1,41 @@
+import hashlib
+
+# width of a single primary key digest in bytes
+DIGEST_SIZE = 8
+
+
+def key_digest(values) -> bytes:
+    """
+    Returns fixed-width digest of a primary key tuple. Missing values (None / NaN) hash the same as empty string.
+    """
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for value in values:
+        if value is None or value != value:
+            value = ''
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.digest()
+
+
+class PrimaryKeyIndex:
+    """
+    In-run index of primary key digests of already written rows of a single output table.
+    """
+
+    def __init__(self):
+        self._digests = set()
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._digests)
+
+    def add(self, values) -> bool:
+        """
+        Registers primary key tuple, returns False if the key was already written before.
+        """
+        digest = key_digest(values)
+        if digest in self._digests:
+            self.duplicates += 1
+            return False
+        self._digests.add(digest)
+        return True
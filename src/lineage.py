@@ -0,0 +1,152 @@
+from collections import deque
+
+# relation which is not a dependency, it is kept in the edges but not followed in the closure
+CONTAINMENT = 'in_workspace'
+
+
+def _id(value):
+    """
+    Returns the id as string, None for missing values and the empty placeholders of the datasources extractor.
+    """
+    if isinstance(value, str) and value:
+        return value
+    return None
+
+
+def _node(node_type, value):
+    value = _id(value)
+    return f"{node_type}:{value}" if value else None
+
+
+def _report_edges(row):
+    report = _node('report', row.get('id'))
+    return [(report, ('uses_dataset', _node('dataset', row.get('datasetId')))),
+            (report, (CONTAINMENT, _node('workspace', row.get('parent_id'))))]
+
+
+def _dashboard_edges(row):
+    return [(_node('dashboard', row.get('id')), (CONTAINMENT, _node('workspace', row.get('group_id_parent'))))]
+
+
+def _dataset_edges(row):
+    dataset = _node('dataset', row.get('id'))
+    edges = [(dataset, (CONTAINMENT, _node('workspace', row.get('parent_id'))))]
+    upstream = row.get('upstreamDatasets')
+    if isinstance(upstream, list):
+        for upstream_dataset in upstream:
+            edges.append((dataset, ('upstream_dataset', _node('dataset', upstream_dataset.get('targetDatasetId')))))
+    return edges
+
+
+def _dataset_datasource_edges(row):
+    dataset = _node('dataset', row.get('dataset_id_parent'))
+    datasource = _node('datasource', row.get('datasource_id'))
+    gateway = _node('gateway', row.get('gateway_id'))
+    if datasource:
+        return [(dataset, ('uses_datasource', datasource)), (datasource, ('via_gateway', gateway))]
+    return [(dataset, ('uses_gateway', gateway))]
+
+
+def _gateway_datasource_edges(row):
+    return [(_node('datasource', row.get('id')), ('via_gateway', _node('gateway', row.get('gateway_id'))))]
+
+
+# output tables the lineage is built from, with the function returning (source node, (relation, target node)) edges
+LINEAGE_TABLES = {
+    'pbi_reports_actual.csv': _report_edges,
+    'pbi_dashboards.csv': _dashboard_edges,
+    'pbi_datasets_refresh.csv': _dataset_edges,
+    'pbi_datasets_datasources.csv': _dataset_datasource_edges,
+    'pbi_datasources_gateway.csv': _gateway_datasource_edges
+}
+
+
+def split_node(node):
+    node_type, node_id = node.split(':', 1)
+    return node_type, node_id
+
+
+class LineageGraph:
+    """
+    Lineage graph of workspaces, datasets, reports, dashboards, datasources and gateways.
+
+    Outgoing edges of every node are kept in the state per source table. After a run only nodes whose edges changed,
+    and the nodes depending on them, get their edges and transitive closure recomputed.
+    """
+
+    def __init__(self, state: dict = None):
+        self.full = state is None
+        self._previous = {table: {node: set(edges) for node, edges in nodes.items()}
+                          for table, nodes in (state or {}).items()}
+        self._current = {}
+
+    def add_rows(self, table_name, rows):
+        nodes = self._current.setdefault(table_name, {})
+        for row in rows:
+            for source, (relation, target) in LINEAGE_TABLES[table_name](row):
+                if source is None:
+                    continue
+                edges = nodes.setdefault(source, set())
+                if target is not None:
+                    edges.add(f"{relation}>{target}")
+
+    @staticmethod
+    def _adjacency(tables):
+        adjacency = {}
+        for nodes in tables.values():
+            for node, edges in nodes.items():
+                adjacency.setdefault(node, set()).update(edges)
+        return adjacency
+
+    def finish(self, complete_tables):
+        """
+        Merges the rows of this run with the previous graph. Nodes of tables which were not fully extracted in
+        this run keep their previous edges.
+
+        Returns the graph state for the next run, the changed nodes with their edges and the affected nodes
+        with their closure as {ancestor: depth}.
+        """
+        tables = {}
+        for table in set(self._previous) | set(self._current):
+            if table in complete_tables:
+                tables[table] = self._current.get(table, {})
+            else:
+                tables[table] = {**self._previous.get(table, {}), **self._current.get(table, {})}
+
+        old = self._adjacency(self._previous)
+        new = self._adjacency(tables)
+        changed = {node for node in set(old) | set(new) if old.get(node) != new.get(node)}
+
+        dependencies = {}
+        dependants = {}
+        for node, edges in new.items():
+            for edge in edges:
+                relation, target = edge.split('>', 1)
+                if relation != CONTAINMENT:
+                    dependencies.setdefault(node, set()).add(target)
+                    dependants.setdefault(target, set()).add(node)
+
+        affected = set(changed)
+        queue = deque(changed)
+        while queue:
+            for dependant in dependants.get(queue.popleft(), ()):
+                if dependant not in affected:
+                    affected.add(dependant)
+                    queue.append(dependant)
+
+        closure = {node: self._closure(node, dependencies) for node in affected}
+        changed_edges = {node: sorted(new.get(node, ())) for node in changed}
+        state = {table: {node: sorted(edges) for node, edges in nodes.items()} for table, nodes in tables.items()}
+        return state, changed_edges, closure
+
+    @staticmethod
+    def _closure(node, dependencies):
+        depths = {}
+        queue = deque([(node, 0)])
+        while queue:
+            current, depth = queue.popleft()
+            for ancestor in dependencies.get(current, ()):
+                if ancestor not in depths and ancestor != node:
+                    depths[ancestor] = depth + 1
+                    queue.append((ancestor, depth + 1))
+        return depths
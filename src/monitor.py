@@ -0,0 +1,169 @@
+import logging
+
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+from dateutil import tz
+
+from windows_zones import WINDOWS_ZONES
+
+# status of a refresh which is still running
+IN_PROGRESS = 'Unknown'
+# polling interval of a dataset right after its refresh status changed, in seconds
+MIN_INTERVAL = 30
+# longest polling interval of a dataset whose refresh status does not change, in seconds
+MAX_INTERVAL = 15 * 60
+BACKOFF = 2
+# how long after the scheduled time a dataset is polled for a starting refresh, in seconds
+SCHEDULE_WINDOW = 30 * 60
+
+
+def refresh_state(group_id, refresh: dict) -> dict:
+    """
+    Returns the last known state of a dataset refresh as kept in the state file.
+    """
+    return {
+        "group_id": group_id,
+        "id": refresh.get('id'),
+        "request_id": refresh.get('requestId'),
+        "refresh_type": refresh.get('refreshType'),
+        "status": refresh.get('status'),
+        "start_time": refresh.get('startTime'),
+        "end_time": refresh.get('endTime')
+    }
+
+
+def refresh_schedule(group_id, schedule: dict) -> dict:
+    return {
+        "group_id": group_id,
+        "days": schedule.get('days') or [],
+        "times": schedule.get('times') or [],
+        "time_zone": schedule.get('localTimeZoneId')
+    }
+
+
+def retry_after(value, now: float) -> float:
+    """
+    Returns the number of seconds to wait from the Retry-After header of a throttled response,
+    given as seconds or HTTP date. MIN_INTERVAL when the header is missing or malformed.
+    """
+    if not value:
+        return MIN_INTERVAL
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return MIN_INTERVAL
+
+
+_unknown_zones = set()
+
+
+def schedule_zone(time_zone):
+    """
+    Returns the time zone of a refresh schedule, Power BI uses Windows time zone ids. None if the zone is not known.
+    """
+    if not time_zone:
+        return timezone.utc
+    zone = tz.gettz(WINDOWS_ZONES.get(time_zone, time_zone))
+    if zone is None and time_zone not in _unknown_zones:
+        _unknown_zones.add(time_zone)
+        logging.warning(f"Unknown refresh schedule time zone {time_zone}, its schedules are not tracked")
+    return zone
+
+
+def is_due_by_schedule(schedule: dict, now: datetime) -> bool:
+    """
+    Returns True if a scheduled refresh of the dataset started within the last SCHEDULE_WINDOW.
+    Schedules in time zones which cannot be mapped are never due.
+    """
+    if not schedule or not schedule['times']:
+        return False
+
+    zone = schedule_zone(schedule['time_zone'])
+    if zone is None:
+        return False
+
+    local_now = now.astimezone(zone)
+    for days_back in (0, 1):
+        day = local_now - timedelta(days=days_back)
+        if schedule['days'] and day.strftime('%A') not in schedule['days']:
+            continue
+        for scheduled_time in schedule['times']:
+            hour, minute = scheduled_time.split(':')[:2]
+            start = day.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+            if start <= local_now < start + timedelta(seconds=SCHEDULE_WINDOW):
+                return True
+    return False
+
+
+class RefreshMonitor:
+    """
+    Tracks datasets with a refresh in progress or due by the refresh schedule and decides when to poll them.
+
+    Every tracked dataset has its own polling interval, it is reset when the refresh status changes
+    and grows up to MAX_INTERVAL while nothing happens.
+    """
+
+    def __init__(self, refresh_status: dict, schedules: dict):
+        self.status = refresh_status
+        self.schedules = schedules
+        self._polls = {}
+
+    def __len__(self):
+        return len(self._polls)
+
+    def group_id(self, dataset_id):
+        return (self.status.get(dataset_id) or self.schedules[dataset_id])['group_id']
+
+    def update_tracking(self, now: float):
+        now_dt = datetime.fromtimestamp(now, timezone.utc)
+        for dataset_id in set(self.status) | set(self.schedules):
+            known = self.status.get(dataset_id, {})
+            if known.get('status') == IN_PROGRESS or is_due_by_schedule(self.schedules.get(dataset_id), now_dt):
+                self._polls.setdefault(dataset_id, (now, MIN_INTERVAL))
+            else:
+                self._polls.pop(dataset_id, None)
+
+    def due(self, now: float):
+        return [dataset_id for dataset_id, (next_poll, _) in self._polls.items() if next_poll <= now]
+
+    def next_poll(self):
+        return min((next_poll for next_poll, _ in self._polls.values()), default=None)
+
+    def forget(self, dataset_id):
+        self.status.pop(dataset_id, None)
+        self.schedules.pop(dataset_id, None)
+        self._polls.pop(dataset_id, None)
+
+    def observe(self, dataset_id, refresh, now: float):
+        """
+        Records the latest refresh of the dataset, returns the transition row if the refresh or its status changed.
+        """
+        known = self.status.get(dataset_id, {})
+        interval = self._polls.get(dataset_id, (now, MIN_INTERVAL))[1]
+
+        transition = None
+        if refresh is not None:
+            current = refresh_state(self.group_id(dataset_id), refresh)
+            if (current['id'], current['status']) != (known.get('id'), known.get('status')):
+                transition = {
+                    "dataset_id": dataset_id,
+                    "group_id": current['group_id'],
+                    "refresh_id": current['id'],
+                    "request_id": current['request_id'],
+                    "refresh_type": current['refresh_type'],
+                    "previous_status": known.get('status') if current['id'] == known.get('id') else None,
+                    "status": current['status'],
+                    "start_time": current['start_time'],
+                    "end_time": current['end_time'],
+                    "observed_at": datetime.fromtimestamp(now, timezone.utc).isoformat()
+                }
+                self.status[dataset_id] = current
+
+        interval = MIN_INTERVAL if transition else min(interval * BACKOFF, MAX_INTERVAL)
+        self._polls[dataset_id] = (now + interval, interval)
+        return transition
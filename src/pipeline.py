@@ -0,0 +1,72 @@
+import threading
+import time
+
+from collections import deque
+
+
+def _timed(fetch, item):
+    started = time.monotonic()
+    payload = fetch(item)
+    return payload, time.monotonic() - started
+
+
+class FetchPipeline:
+    """
+    Overlaps the API requests of a stage with the processing of their responses.
+
+    Requests run on the executor while the caller normalizes and writes the previous responses. At most
+    `max_pending` requests are in flight, so a slow consumer bounds the memory held by fetched responses,
+    and responses are yielded in the order of the items.
+    """
+
+    def __init__(self, executor, max_pending: int):
+        self._executor = executor
+        self._max_pending = max(1, max_pending)
+
+    def run(self, items, fetch):
+        """
+        Yields (item, payload, duration) for every item, the duration being the wall time of its fetch.
+        Items are pulled lazily, only when there is room for another request in flight.
+        """
+        pending = deque()
+        items = iter(items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self._max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((item, self._executor.submit(_timed, fetch, item)))
+
+            if not pending:
+                return
+
+            item, future = pending.popleft()
+            payload, duration = future.result()
+            yield item, payload, duration
+
+
+class RateLimiter:
+    """
+    Spaces the requests of all fetch workers at least `interval` seconds apart. After a throttled response
+    all workers are paused for the time the server asked for.
+    """
+
+    def __init__(self, interval: float = 0):
+        self._interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
@@ -0,0 +1,68 @@
+import math
+
+# latency assumed for stages not measured in any previous run, in seconds
+DEFAULT_LATENCY = 1.0
+
+# entity count each extraction stage makes one request for, None for stages making a single listing request
+STAGE_ENTITIES = {
+    'groups': None,
+    'users': 'groups',
+    'datasets': 'groups',
+    'dashboards': 'groups',
+    'reports': 'groups',
+    'gateways': None,
+    'datasources_gateway': 'gateways',
+    'datasets_refreshes': 'refreshable_datasets',
+    'datasets_datasources': 'datasets',
+    'datasets_refresh_schedule': 'refreshable_datasets'
+}
+
+
+def plan_stage(stage, counts: dict, latency: dict, skipped: dict, concurrency: int) -> dict:
+    """
+    Returns the expected number of requests and wall time of a single stage.
+    Requests and time are None when the entity count of the stage is not known.
+    """
+    entity = STAGE_ENTITIES[stage]
+    entities = 1 if entity is None else counts.get(entity)
+    stage_latency = latency.get(stage, DEFAULT_LATENCY)
+
+    requests = None
+    seconds = None
+    if entities is not None:
+        requests = max(0, entities - skipped.get(stage, 0))
+        parallel = 1 if entity is None else max(1, concurrency)
+        seconds = requests * stage_latency / parallel
+
+    return {
+        "stage": stage,
+        "entities": entities,
+        "requests": requests,
+        "skipped_requests": skipped.get(stage, 0),
+        "latency_seconds": round(stage_latency, 3),
+        "estimated_seconds": None if seconds is None else round(seconds, 1)
+    }
+
+
+def plan_summary(stage_plans, requests_per_hour: int = None, max_runtime: int = None) -> dict:
+    """
+    Sums the stage plans. With a request quota set, the wall time is extended to what the quota allows
+    and the summary tells whether the requests of any hour of the run stay within the quota.
+    """
+    known = [stage_plan for stage_plan in stage_plans if stage_plan['requests'] is not None]
+    requests = sum(stage_plan['requests'] for stage_plan in known)
+    seconds = sum(stage_plan['estimated_seconds'] for stage_plan in known)
+
+    fits_quota = None
+    if requests_per_hour:
+        peak_hourly = requests * min(1, 3600 / seconds) if seconds else requests
+        fits_quota = peak_hourly <= requests_per_hour
+        seconds = max(seconds, (math.ceil(requests / requests_per_hour) - 1) * 3600)
+
+    return {
+        "requests": requests,
+        "estimated_seconds": round(seconds, 1),
+        "unknown_stages": [stage_plan['stage'] for stage_plan in stage_plans if stage_plan['requests'] is None],
+        "fits_quota": fits_quota,
+        "fits_runtime": None if not max_runtime else seconds <= max_runtime
+    }
@@ -0,0 +1,181 @@
+import math
+
+from dateutil.parser import isoparse
+
+from monitor import IN_PROGRESS
+
+# relative error of the duration quantiles
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# durations up to this many seconds are counted together as zero
+MIN_DURATION = 1.0
+# most buckets kept per sketch, the shortest durations are collapsed first when exceeded
+MAX_BUCKETS = 128
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with logarithmic buckets, every quantile is within RELATIVE_ACCURACY of the exact value.
+
+    Bucket `i` counts values in (GAMMA^(i-1), GAMMA^i], two sketches are merged by adding their bucket counts.
+    """
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.zeros = state.get('zeros', 0)
+        self.buckets = {int(index): count for index, count in state.get('buckets', {}).items()}
+
+    @property
+    def count(self) -> int:
+        return self.zeros + sum(self.buckets.values())
+
+    def add(self, value, count=1):
+        if value <= MIN_DURATION:
+            self.zeros += count
+        else:
+            index = math.ceil(math.log(value, GAMMA))
+            self.buckets[index] = self.buckets.get(index, 0) + count
+            self._collapse()
+
+    def merge(self, other: 'QuantileSketch'):
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self._collapse()
+
+    def _collapse(self):
+        while len(self.buckets) > MAX_BUCKETS:
+            count = self.buckets.pop(min(self.buckets))
+            following = min(self.buckets)
+            self.buckets[following] += count
+
+    def quantile(self, q):
+        """
+        Returns the value at quantile q, None for an empty sketch.
+        """
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * GAMMA ** index / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.buckets) / (GAMMA + 1)
+
+    def to_state(self) -> dict:
+        return {'zeros': self.zeros, 'buckets': {str(index): count for index, count in self.buckets.items()}}
+
+
+def _duration(refresh):
+    try:
+        duration = (isoparse(refresh['endTime']) - isoparse(refresh['startTime'])).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return None
+    return duration if duration >= 0 else None
+
+
+class RefreshStatistics:
+    """
+    Running refresh statistics of every dataset, kept in the state and updated with the refreshes seen in each run.
+
+    The refreshes endpoint returns the refresh history of the dataset, so refreshes already counted are recognized
+    by a watermark on the start time. Refreshes in progress are not counted and keep the watermark before them,
+    the finished refreshes after the watermark are remembered until it moves past them.
+    """
+
+    def __init__(self, state: dict = None):
+        self._datasets = dict(state or {})
+
+    def __len__(self):
+        return len(self._datasets)
+
+    def update(self, dataset_id, group_id, refreshes) -> int:
+        """
+        Adds the finished refreshes not counted yet, returns their number.
+        """
+        stats = self._datasets.setdefault(dataset_id, {
+            "statuses": {}, "duration_count": 0, "duration_sum": 0.0, "duration": {}, "watermark": None,
+            "counted": {}, "last_refresh": None, "last_status": None, "last_success": None
+        })
+        stats['group_id'] = group_id
+        watermark = stats['watermark']
+        counted = dict(stats['counted'])
+        sketch = QuantileSketch(stats['duration'])
+
+        added = 0
+        latest = watermark
+        in_progress = []
+        for refresh in refreshes:
+            start = refresh.get('startTime')
+            if not start or (watermark is not None and start < watermark):
+                continue
+            latest = max(latest or start, start)
+            if refresh.get('status') == IN_PROGRESS:
+                in_progress.append(start)
+                continue
+
+            key = str(refresh.get('id') or refresh.get('requestId') or start)
+            if key in counted:
+                continue
+            counted[key] = start
+            added += 1
+
+            status = refresh.get('status')
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            duration = _duration(refresh)
+            if duration is not None:
+                sketch.add(duration)
+                stats['duration_count'] += 1
+                stats['duration_sum'] += duration
+            if stats['last_refresh'] is None or start >= stats['last_refresh']:
+                stats['last_refresh'] = start
+                stats['last_status'] = status
+            end = refresh.get('endTime')
+            if status == 'Completed' and end and (stats['last_success'] is None or end > stats['last_success']):
+                stats['last_success'] = end
+
+        stats['watermark'] = min(in_progress) if in_progress else latest
+        stats['counted'] = {key: start for key, start in counted.items()
+                            if stats['watermark'] is None or start >= stats['watermark']}
+        stats['duration'] = sketch.to_state()
+        return added
+
+    def prune(self, dataset_ids):
+        """
+        Drops the statistics of datasets which no longer exist.
+        """
+        self._datasets = {dataset_id: stats for dataset_id, stats in self._datasets.items()
+                          if dataset_id in dataset_ids}
+
+    def rows(self):
+        for dataset_id, stats in self._datasets.items():
+            refreshes = sum(stats['statuses'].values())
+            failed = stats['statuses'].get('Failed', 0)
+            sketch = QuantileSketch(stats['duration'])
+            row = {
+                "dataset_id": dataset_id,
+                "group_id": stats.get('group_id'),
+                "refreshes": refreshes,
+                "completed": stats['statuses'].get('Completed', 0),
+                "failed": failed,
+                "failure_rate": round(failed / refreshes, 4) if refreshes else None,
+                "duration_mean": (round(stats['duration_sum'] / stats['duration_count'], 1)
+                                  if stats['duration_count'] else None)
+            }
+            for q in QUANTILES:
+                value = sketch.quantile(q)
+                row[f"duration_p{round(q * 100)}"] = None if value is None else round(value, 1)
+            row.update({
+                "last_refresh_time": stats['last_refresh'],
+                "last_status": stats['last_status'],
+                "last_success_time": stats['last_success']
+            })
+            yield row
+
+    def to_state(self) -> dict:
+        return self._datasets
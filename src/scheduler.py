@@ -0,0 +1,126 @@
+import time
+
+# part of the runtime budget reserved for closing the output and writing the state, in seconds
+FINISH_MARGIN = 60
+# entities not fetched successfully for this long are dropped from the state, in seconds
+LAST_SUCCESS_RETENTION = 90 * 24 * 3600
+# weight of the latest measurement in the moving average of item latency
+LATENCY_WEIGHT = 0.2
+
+
+class WorkScheduler:
+    """
+    Orders work items of the extraction stages by staleness and stops handing them out before the runtime
+    budget is exhausted.
+
+    Work items are identified as `<stage>/<entity id>`. Items and stages left over when the budget runs out are
+    persisted in the state and handed out first in the next run, the rest is ordered by the time of the
+    last successful fetch, so every entity gets refreshed within a bounded number of runs.
+    """
+
+    def __init__(self, state: dict = None, max_runtime: float = None):
+        state = state or {}
+        self.now = time.time()
+        self.deadline = None
+        if max_runtime:
+            self.deadline = time.monotonic() + max_runtime - min(FINISH_MARGIN, max_runtime * 0.1)
+
+        self.last_success = {key: ts for key, ts in state.get('last_success', {}).items()
+                             if ts > self.now - LAST_SUCCESS_RETENTION}
+        self.stages = dict(state.get('stages', {}))
+        self.latency = dict(state.get('latency', {}))
+        self._carried = set(state.get('carry_over', []))
+
+        self.carry_over = []
+        self.incomplete = set()
+        self.stopped = False
+        self.stage_deadline = None
+        self._item_stages = set()
+
+    def start_stage(self, stages_left: int):
+        """
+        Gives the starting stage an equal share of the remaining budget with the stages left after it,
+        so that stages late in the order run in every run even if the first ones cannot finish.
+        Time the stage does not use is left to the following stages.
+        """
+        self.stage_deadline = None
+        if self.deadline is not None:
+            now = time.monotonic()
+            self.stage_deadline = now + (self.deadline - now) / (1 + stages_left)
+
+    def out_of_time(self, stage) -> bool:
+        """
+        Returns True if the next item of the stage is not expected to finish before the deadline of the run.
+        """
+        if self.deadline is not None and time.monotonic() + self.latency.get(stage, 0) >= self.deadline:
+            self.stopped = True
+        return self.stopped
+
+    def _over_share(self, stage) -> bool:
+        return self.stage_deadline is not None and time.monotonic() + self.latency.get(stage, 0) >= self.stage_deadline
+
+    def _own_priority(self, stage):
+        carried = stage in self._carried or any(key.startswith(f"{stage}/") for key in self._carried)
+        return not carried, self.stages.get(stage, 0)
+
+    def stage_priority(self, stage, descendants=()):
+        """
+        Returns the sort key of the stage. A stage inherits the highest priority of its descendants,
+        so that the input of carried over or stale stages is fetched first.
+        """
+        return min(self._own_priority(current) for current in [stage, *descendants])
+
+    def iterate(self, stage, entities, key=None):
+        """
+        Yields the entities of the stage, carried over and the least recently fetched ones first.
+        Stops when the budget or the share of the stage is exhausted and carries the rest over to the next run.
+        At least one item is started unless the budget of the run is exhausted, so that every stage progresses
+        even if its item latency exceeds its share.
+        """
+        key = key or (lambda entity: entity)
+        self._item_stages.add(stage)
+
+        def priority(entity):
+            item = f"{stage}/{key(entity)}"
+            return item not in self._carried, self.last_success.get(item, 0)
+
+        ordered = sorted(entities, key=priority)
+        for position, entity in enumerate(ordered):
+            if self.out_of_time(stage) or (position and self._over_share(stage)):
+                self.incomplete.add(stage)
+                self.carry_over.extend(f"{stage}/{key(rest)}" for rest in ordered[position:])
+                return
+
+            yield entity
+
+    def record(self, stage, entity_id, duration, succeeded=True):
+        """
+        Records the wall time of the request of an item of the stage. Items whose request did not succeed
+        keep their last success time, so they stay first in the order.
+        """
+        self._record_latency(stage, duration)
+        if succeeded:
+            self.last_success[f"{stage}/{entity_id}"] = self.now
+
+    def _record_latency(self, stage, duration):
+        if stage in self.latency:
+            duration = (1 - LATENCY_WEIGHT) * self.latency[stage] + LATENCY_WEIGHT * duration
+        self.latency[stage] = duration
+
+    def finish_stage(self, stage, duration):
+        if stage not in self._item_stages:
+            self._record_latency(stage, duration)
+        if stage not in self.incomplete:
+            self.stages[stage] = self.now
+
+    def skip_stage(self, stage):
+        self.incomplete.add(stage)
+        self.carry_over.append(stage)
+
+    def to_state(self) -> dict:
+        return {
+            'last_success': self.last_success,
+            'stages': self.stages,
+            'latency': self.latency,
+            'carry_over': self.carry_over
+        }
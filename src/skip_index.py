@@ -0,0 +1,52 @@
+import random
+import threading
+import time
+
+from collections import Counter
+
+# how long an entity is skipped after the endpoint failed with an access error, in seconds
+ERROR_TTL = 7 * 24 * 3600
+# how long an entity is skipped after the endpoint returned no data, in seconds
+EMPTY_TTL = 24 * 3600
+# relative random spread of the expiry, so that the skipped entities are re-probed in different runs
+JITTER = 0.5
+
+
+class SkipIndex:
+    """
+    Persisted index of endpoint calls known to fail or return no data, keyed by endpoint and entity id.
+
+    Every entry expires after a jittered TTL, after that the call is made again and the entry is either renewed
+    or dropped.
+    """
+
+    def __init__(self, entries: dict = None, now: float = None):
+        self.now = now or time.time()
+        self._entries = {key: expiry for key, expiry in (entries or {}).items() if expiry > self.now}
+        self.skipped = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(endpoint, entity_id):
+        return f"{endpoint}/{entity_id}"
+
+    def should_skip(self, endpoint, entity_id) -> bool:
+        with self._lock:
+            if self._key(endpoint, entity_id) in self._entries:
+                self.skipped[endpoint] += 1
+                return True
+            return False
+
+    def count(self, endpoint) -> int:
+        """
+        Returns the number of entities currently skipped for the endpoint.
+        """
+        return sum(1 for key in self._entries if key.startswith(f"{endpoint}/"))
+
+    def mark(self, endpoint, entity_id, empty=False):
+        ttl = EMPTY_TTL if empty else ERROR_TTL
+        with self._lock:
+            self._entries[self._key(endpoint, entity_id)] = self.now + ttl * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def to_state(self) -> dict:
+        return dict(self._entries)
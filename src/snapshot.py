@@ -0,0 +1,124 @@
+import gzip
+import json
+import shutil
+import struct
+import tempfile
+
+import numpy
+
+from dedup import key_digest
+
+# snapshot file: header, records sorted by the key digest, gzip compressed primary key lines
+MAGIC = b'PBISNAP1'
+HEADER = struct.Struct('>8sQ')
+# key digest, row digest and the number of the primary key line of each row
+RECORD = numpy.dtype([('key', '>u8'), ('row', '>u8'), ('line', '>u8')])
+RECORD_STRUCT = struct.Struct('>QQQ')
+
+
+def _digest(values) -> int:
+    return int.from_bytes(key_digest(values), 'big')
+
+
+def _read_records(path):
+    with open(path, 'rb') as f:
+        magic, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a row snapshot")
+        return numpy.fromfile(f, dtype=RECORD, count=count)
+
+
+def _iter_keys(path, records):
+    """
+    Streams the primary key lines stored after the records of the snapshot file.
+    """
+    with open(path, 'rb') as f:
+        f.seek(HEADER.size + records * RECORD.itemsize)
+        with gzip.GzipFile(fileobj=f, mode='rb') as keys:
+            yield from keys
+
+
+class RowSnapshot:
+    """
+    Primary key -> row content hash snapshot of a single output table, persisted as a file between runs.
+
+    The file holds fixed-width (key digest, row digest, key line) records sorted by the key digest, followed by
+    the primary key values as gzip compressed JSON lines. Only the records are loaded while comparing,
+    primary key values of the previous run are streamed from the file when the snapshot is finished.
+    """
+
+    def __init__(self, path: str = None):
+        self._path = path
+        self._previous = _read_records(path) if path else numpy.empty(0, dtype=RECORD)
+        self._previous_keys = self._previous['key']
+        self._seen = numpy.zeros(len(self._previous), dtype=bool)
+
+        self._records = bytearray()
+        self._keys_file = tempfile.TemporaryFile()
+        self._keys = gzip.GzipFile(fileobj=self._keys_file, mode='wb')
+        self._lines = 0
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.deleted = 0
+
+    def _add(self, key, row_hash, pk_line: bytes):
+        self._records += RECORD_STRUCT.pack(key, row_hash, self._lines)
+        self._keys.write(pk_line)
+        self._lines += 1
+
+    def update(self, pk, row) -> bool:
+        """
+        Records the current content of the row, returns True if the row is new or changed since the last run.
+        """
+        pk = ['' if value is None or value != value else str(value) for value in pk]
+        key = _digest(pk)
+        row_hash = _digest(row)
+        self._add(key, row_hash, f"{json.dumps(pk)}\n".encode())
+
+        position = numpy.searchsorted(self._previous_keys, key)
+        if position == len(self._previous) or self._previous_keys[position] != key or self._seen[position]:
+            self.inserted += 1
+            return True
+
+        self._seen[position] = True
+        if self._previous['row'][position] != row_hash:
+            self.changed += 1
+            return True
+        self.unchanged += 1
+        return False
+
+    def finish(self, path, complete: bool = True):
+        """
+        Writes the snapshot for the next run to the path. Returns list of primary keys that were present
+        in the previous snapshot but not seen in this run.
+
+        If the run was not complete, rows not seen in this run are kept in the snapshot and no deletes are reported.
+        """
+        deleted = []
+        unseen = self._previous[~self._seen]
+        if len(unseen):
+            unseen = numpy.sort(unseen, order='line')
+            position = 0
+            for line, pk_line in enumerate(_iter_keys(self._path, len(self._previous))):
+                if position == len(unseen):
+                    break
+                if line != unseen['line'][position]:
+                    continue
+                if complete:
+                    deleted.append(json.loads(pk_line))
+                else:
+                    self._add(int(unseen['key'][position]), int(unseen['row'][position]), pk_line)
+                position += 1
+
+        self.deleted = len(deleted)
+        self._keys.close()
+        records = numpy.sort(numpy.frombuffer(bytes(self._records), dtype=RECORD), order='key', kind='stable')
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(records)))
+            f.write(records.tobytes())
+            self._keys_file.seek(0)
+            shutil.copyfileobj(self._keys_file, f)
+        self._keys_file.close()
+        return deleted
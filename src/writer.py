@@ -0,0 +1,70 @@
+import gzip
+import io
+import json
+import os
+import shutil
+
+# size of uncompressed CSV data buffered before it is handed over as a single slice
+SLICE_SIZE = 64 * 1024 * 1024
+# maximum number of slices waiting for compression per table, bounds the memory used by buffered data
+MAX_PENDING_SLICES = 4
+COMPRESS_LEVEL = 6
+
+
+def _write_slice(path, data):
+    with open(path, "wb") as f:
+        f.write(gzip.compress(data.encode('utf-8'), compresslevel=COMPRESS_LEVEL))
+
+
+class SlicedTableWriter:
+    """
+    Writes headless CSV rows of a single output table as a folder of gzip compressed slices.
+
+    Rows are serialized on the calling thread, compression and disk writes run on the shared executor.
+    """
+
+    def __init__(self, path, executor, slice_size=SLICE_SIZE):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.makedirs(path)
+
+        self.path = path
+        self._executor = executor
+        self._slice_size = slice_size
+        self._buffer = io.StringIO()
+        self._pending = []
+        self.slices = 0
+
+    def write(self, to_write, columns):
+        to_write.to_csv(self._buffer, header=False, index=False, columns=columns)
+        if self._buffer.tell() >= self._slice_size:
+            self._flush()
+
+    def _flush(self):
+        data = self._buffer.getvalue()
+        if not data:
+            return
+        self._buffer = io.StringIO()
+
+        slice_path = os.path.join(self.path, f"slice_{self.slices:05d}.csv.gz")
+        self.slices += 1
+        self._pending.append(self._executor.submit(_write_slice, slice_path, data))
+
+        while len(self._pending) > MAX_PENDING_SLICES:
+            self._pending.pop(0).result()
+
+    def close(self):
+        self._flush()
+        while self._pending:
+            self._pending.pop(0).result()
+
+
+def to_json(value):
+    """
+    Serializes nested lists and objects as compact JSON, other values are kept.
+    """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    return value
@@ -0,0 +1,23 @@
+import unittest
+
+from dedup import PrimaryKeyIndex, key_digest, DIGEST_SIZE
+
+
+class TestPrimaryKeyIndex(unittest.TestCase):
+
+    def test_duplicate_keys_are_dropped(self):
+        index = PrimaryKeyIndex()
+        self.assertTrue(index.add(('a@b.com', 'Admin', 'g1')))
+        self.assertTrue(index.add(('a@b.com', 'Admin', 'g2')))
+        self.assertFalse(index.add(('a@b.com', 'Admin', 'g1')))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.duplicates, 1)
+
+    def test_missing_values_hash_as_empty(self):
+        self.assertEqual(key_digest(('id', None)), key_digest(('id', float('nan'))))
+        self.assertEqual(key_digest(('id', None)), key_digest(('id', '')))
+        self.assertEqual(len(key_digest(('id',))), DIGEST_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
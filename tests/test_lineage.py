@@ -0,0 +1,37 @@
+import unittest
+
+from lineage import LineageGraph
+
+
+class TestLineageGraph(unittest.TestCase):
+
+    def _build(self, state, gateway_id):
+        graph = LineageGraph(state)
+        graph.add_rows('pbi_reports_actual.csv', [{'id': 'r1', 'datasetId': 'd1', 'parent_id': 'w1'}])
+        graph.add_rows('pbi_datasets_refresh.csv', [
+            {'id': 'd1', 'parent_id': 'w1', 'upstreamDatasets': [{'targetDatasetId': 'd2', 'groupId': 'w1'}]},
+            {'id': 'd2', 'parent_id': 'w1', 'upstreamDatasets': float('nan')}
+        ])
+        graph.add_rows('pbi_datasets_datasources.csv', [
+            {'dataset_id_parent': 'd2', 'datasource_id': 's1', 'gateway_id': gateway_id}
+        ])
+        return graph.finish(['pbi_reports_actual.csv', 'pbi_datasets_refresh.csv', 'pbi_datasets_datasources.csv'])
+
+    def test_closure_reaches_gateway(self):
+        state, changed, closure = self._build(None, 'gw1')
+        self.assertEqual(closure['report:r1'], {'dataset:d1': 1, 'dataset:d2': 2, 'datasource:s1': 3, 'gateway:gw1': 4})
+        self.assertIn('in_workspace>workspace:w1', changed['report:r1'])
+
+    def test_only_dependants_of_changed_nodes_are_recomputed(self):
+        state, _, _ = self._build(None, 'gw1')
+        state, changed, closure = self._build(state, 'gw2')
+        self.assertEqual(set(changed), {'datasource:s1'})
+        self.assertEqual(set(closure), {'datasource:s1', 'dataset:d2', 'dataset:d1', 'report:r1'})
+        self.assertEqual(closure['report:r1']['gateway:gw2'], 4)
+
+        _, changed, closure = self._build(state, 'gw2')
+        self.assertEqual((changed, closure), ({}, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
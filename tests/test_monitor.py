@@ -0,0 +1,51 @@
+import unittest
+from datetime import datetime, timezone
+
+from monitor import RefreshMonitor, is_due_by_schedule, retry_after, MIN_INTERVAL, BACKOFF
+
+
+class TestRefreshMonitor(unittest.TestCase):
+
+    def test_only_in_progress_datasets_are_polled(self):
+        status = {
+            'd1': {'group_id': 'g1', 'id': 1, 'status': 'Unknown'},
+            'd2': {'group_id': 'g1', 'id': 2, 'status': 'Completed'}
+        }
+        monitor = RefreshMonitor(status, {})
+        monitor.update_tracking(1000)
+        self.assertEqual(monitor.due(1000), ['d1'])
+
+        self.assertIsNone(monitor.observe('d1', {'id': 1, 'status': 'Unknown'}, 1000))
+        self.assertEqual(monitor.next_poll(), 1000 + MIN_INTERVAL * BACKOFF)
+
+        transition = monitor.observe('d1', {'id': 1, 'status': 'Completed'}, 1100)
+        self.assertEqual((transition['previous_status'], transition['status']), ('Unknown', 'Completed'))
+        self.assertEqual(monitor.next_poll(), 1100 + MIN_INTERVAL)
+
+        monitor.update_tracking(1200)
+        self.assertEqual(len(monitor), 0)
+
+    def test_due_by_schedule(self):
+        schedule = {'group_id': 'g1', 'days': ['Monday'], 'times': ['07:00'], 'time_zone': 'UTC'}
+        self.assertTrue(is_due_by_schedule(schedule, datetime(2026, 10, 19, 7, 10, tzinfo=timezone.utc)))
+        self.assertFalse(is_due_by_schedule(schedule, datetime(2026, 10, 19, 8, 0, tzinfo=timezone.utc)))
+        self.assertFalse(is_due_by_schedule(schedule, datetime(2026, 10, 20, 7, 10, tzinfo=timezone.utc)))
+
+    def test_due_by_schedule_in_windows_time_zone(self):
+        schedule = {'group_id': 'g1', 'days': [], 'times': ['07:00'], 'time_zone': 'Central Europe Standard Time'}
+        self.assertTrue(is_due_by_schedule(schedule, datetime(2026, 10, 19, 5, 10, tzinfo=timezone.utc)))
+        self.assertFalse(is_due_by_schedule(schedule, datetime(2026, 10, 19, 7, 10, tzinfo=timezone.utc)))
+
+        schedule['time_zone'] = 'Unknown Standard Time'
+        self.assertFalse(is_due_by_schedule(schedule, datetime(2026, 10, 19, 7, 10, tzinfo=timezone.utc)))
+
+    def test_retry_after(self):
+        now = datetime(2026, 10, 19, 7, 0, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(retry_after('120', now), 120)
+        self.assertEqual(retry_after('Mon, 19 Oct 2026 07:01:30 GMT', now), 90)
+        self.assertEqual(retry_after('soon', now), MIN_INTERVAL)
+        self.assertEqual(retry_after(None, now), MIN_INTERVAL)
+
+
+if __name__ == "__main__":
+    unittest.main()
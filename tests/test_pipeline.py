@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import FetchPipeline, RateLimiter
+
+
+class TestFetchPipeline(unittest.TestCase):
+
+    def test_results_keep_item_order(self):
+        def fetch(item):
+            time.sleep(0.01 * (5 - item))
+            return item * 10
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(FetchPipeline(executor, 8).run(range(5), fetch))
+
+        self.assertEqual([(item, payload) for item, payload, _ in results], [(i, i * 10) for i in range(5)])
+        self.assertTrue(all(duration >= 0 for _, _, duration in results))
+
+    def test_requests_in_flight_are_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def fetch(item):
+            with lock:
+                running.append(item)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(item)
+            return item
+
+        pulled = []
+
+        def items():
+            for item in range(10):
+                pulled.append(item)
+                yield item
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for item, _, _ in FetchPipeline(executor, 3).run(items(), fetch):
+                self.assertLessEqual(len(pulled), item + 4)
+
+        self.assertLessEqual(max(peak), 3)
+
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_requests_of_all_workers_are_spaced(self):
+        limiter = RateLimiter(0.02)
+        started = []
+
+        def fetch(item):
+            limiter.wait()
+            started.append(time.monotonic())
+            return item
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(FetchPipeline(executor, 8).run(range(6), fetch))
+
+        started.sort()
+        self.assertTrue(all(b - a >= 0.015 for a, b in zip(started, started[1:])))
+
+    def test_pause_delays_next_request(self):
+        limiter = RateLimiter()
+        limiter.pause(0.05)
+        started = time.monotonic()
+        limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from planner import plan_stage, plan_summary, DEFAULT_LATENCY
+
+
+class TestPlanner(unittest.TestCase):
+
+    def test_stage_requests_follow_entity_counts(self):
+        counts = {'groups': 10, 'refreshable_datasets': 40}
+        latency = {'users': 0.5, 'datasets_refreshes': 1.0}
+
+        users = plan_stage('users', counts, latency, {'users': 2}, concurrency=4)
+        self.assertEqual((users['requests'], users['estimated_seconds']), (8, 1.0))
+
+        groups = plan_stage('groups', counts, latency, {}, concurrency=4)
+        self.assertEqual((groups['requests'], groups['estimated_seconds']), (1, DEFAULT_LATENCY))
+
+        unknown = plan_stage('datasets_datasources', counts, latency, {}, concurrency=1)
+        self.assertIsNone(unknown['requests'])
+
+    def test_summary_checks_quota(self):
+        stage_plans = [plan_stage('datasets_refreshes', {'refreshable_datasets': 500}, {'datasets_refreshes': 1.0},
+                                  {}, concurrency=1)]
+        summary = plan_summary(stage_plans, requests_per_hour=1000, max_runtime=600)
+        self.assertEqual((summary['requests'], summary['fits_quota'], summary['fits_runtime']), (500, True, True))
+
+        summary = plan_summary(stage_plans, requests_per_hour=200)
+        self.assertFalse(summary['fits_quota'])
+        self.assertEqual(summary['estimated_seconds'], 2 * 3600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from refresh_stats import RELATIVE_ACCURACY, QuantileSketch, RefreshStatistics
+
+
+def _refresh(refresh_id, start_minute, seconds, status='Completed'):
+    return {
+        'id': refresh_id,
+        'startTime': f"2024-01-01T10:{start_minute:02d}:00Z",
+        'endTime': f"2024-01-01T10:{start_minute + seconds // 60:02d}:{seconds % 60:02d}Z",
+        'status': status
+    }
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_quantiles_are_within_accuracy_and_mergeable(self):
+        first = QuantileSketch()
+        second = QuantileSketch()
+        for value in range(1, 1001):
+            (first if value % 2 else second).add(value)
+
+        first.merge(QuantileSketch(second.to_state()))
+        self.assertEqual(first.count, 1000)
+        for q, exact in [(0.5, 500), (0.9, 900), (0.99, 990)]:
+            self.assertAlmostEqual(first.quantile(q), exact, delta=exact * RELATIVE_ACCURACY + 1)
+
+
+class TestRefreshStatistics(unittest.TestCase):
+
+    def test_refreshes_are_counted_once(self):
+        stats = RefreshStatistics()
+        history = [_refresh(3, 20, 0, status='Unknown'), _refresh(2, 10, 120, status='Failed'), _refresh(1, 0, 60)]
+        self.assertEqual(stats.update('d1', 'g1', history), 2)
+
+        next_run = RefreshStatistics(stats.to_state())
+        history = [_refresh(4, 30, 60), _refresh(3, 20, 180)] + history[1:]
+        self.assertEqual(next_run.update('d1', 'g1', history), 2)
+        self.assertEqual(next_run.update('d1', 'g1', history), 0)
+
+        row, = next_run.rows()
+        self.assertEqual((row['refreshes'], row['completed'], row['failed'], row['failure_rate']), (4, 3, 1, 0.25))
+        self.assertEqual(row['duration_mean'], 105.0)
+        self.assertEqual(row['last_refresh_time'], '2024-01-01T10:30:00Z')
+        self.assertEqual(row['last_success_time'], '2024-01-01T10:31:00Z')
+
+        next_run.prune({'d2'})
+        self.assertEqual(len(next_run), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import mock
+
+from scheduler import WorkScheduler
+
+
+class TestWorkScheduler(unittest.TestCase):
+
+    def test_stale_and_carried_over_items_go_first(self):
+        state = {
+            'last_success': {'users/g1': 300, 'users/g2': 100, 'users/g3': 200},
+            'carry_over': ['users/g1']
+        }
+        scheduler = WorkScheduler(state)
+        scheduler.now = 400
+        scheduler.last_success = state['last_success']
+        self.assertEqual(list(scheduler.iterate('users', ['g1', 'g2', 'g3', 'g4'])), ['g1', 'g4', 'g2', 'g3'])
+
+    @mock.patch('scheduler.time.monotonic')
+    def test_unfinished_items_are_carried_over(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = WorkScheduler(max_runtime=100)
+
+        done = []
+        for entity in scheduler.iterate('users', ['g1', 'g2', 'g3']):
+            done.append(entity)
+            monotonic.return_value += 30
+            scheduler.record('users', entity, 30)
+
+        self.assertEqual(done, ['g1', 'g2'])
+        self.assertIn('users', scheduler.incomplete)
+        self.assertEqual(scheduler.to_state()['carry_over'], ['users/g3'])
+
+        next_run = WorkScheduler(scheduler.to_state())
+        self.assertEqual(next(next_run.iterate('users', ['g1', 'g2', 'g3'])), 'g3')
+        self.assertLess(next_run.stage_priority('users'), next_run.stage_priority('reports'))
+
+    def test_parent_inherits_priority_of_carried_over_descendant(self):
+        scheduler = WorkScheduler({'stages': {'datasets': 300, 'users': 100}, 'carry_over': ['datasets_refreshes/d1']})
+        self.assertLess(scheduler.stage_priority('datasets', ['datasets_refreshes']), scheduler.stage_priority('users'))
+        self.assertGreater(scheduler.stage_priority('datasets'), scheduler.stage_priority('users'))
+
+    @mock.patch('scheduler.time.monotonic')
+    def test_stage_gets_share_of_remaining_budget(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = WorkScheduler(max_runtime=1000)
+        scheduler.start_stage(stages_left=3)
+
+        done = []
+        for entity in scheduler.iterate('datasets', [f"g{i}" for i in range(10)]):
+            done.append(entity)
+            monotonic.return_value += 100
+            scheduler.record('datasets', entity, 100)
+
+        self.assertEqual(len(done), 2)
+        self.assertFalse(scheduler.stopped)
+        scheduler.start_stage(stages_left=2)
+        self.assertFalse(scheduler.out_of_time('datasets_refreshes'))
+
+    @mock.patch('scheduler.time.monotonic')
+    def test_stage_with_latency_over_its_share_still_progresses(self, monotonic):
+        monotonic.return_value = 0
+        scheduler = WorkScheduler({'latency': {'users': 2}}, max_runtime=12)
+        scheduler.start_stage(stages_left=9)
+
+        self.assertFalse(scheduler.out_of_time('users'))
+        self.assertEqual(list(scheduler.iterate('users', ['g1', 'g2'])), ['g1'])
+        self.assertFalse(scheduler.stopped)
+        self.assertEqual(scheduler.carry_over, ['users/g2'])
+
+    def test_failed_items_keep_their_staleness(self):
+        scheduler = WorkScheduler()
+        scheduler.now = 200
+        scheduler.last_success = {'users/g1': 100}
+        scheduler.record('users', 'g1', 1.5, succeeded=False)
+        scheduler.record('users', 'g2', 0.5)
+        self.assertEqual(scheduler.last_success, {'users/g1': 100, 'users/g2': 200})
+        self.assertAlmostEqual(scheduler.latency['users'], 1.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from skip_index import SkipIndex, ERROR_TTL, JITTER
+
+
+class TestSkipIndex(unittest.TestCase):
+
+    def test_marked_entities_are_skipped_until_expiry(self):
+        index = SkipIndex(now=1000)
+        self.assertFalse(index.should_skip('users', 'g1'))
+        index.mark('users', 'g1')
+        self.assertTrue(index.should_skip('users', 'g1'))
+        self.assertFalse(index.should_skip('reports', 'g1'))
+        self.assertEqual(index.skipped['users'], 1)
+
+        state = index.to_state()
+        self.assertTrue(SkipIndex(state, now=1000 + ERROR_TTL * (1 - JITTER) - 1).should_skip('users', 'g1'))
+        self.assertFalse(SkipIndex(state, now=1000 + ERROR_TTL * (1 + JITTER) + 1).should_skip('users', 'g1'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from snapshot import RowSnapshot
+
+
+class TestRowSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.runs = 0
+
+    def _finish(self, snapshot, complete=True):
+        self.runs += 1
+        path = os.path.join(self.folder, f"run_{self.runs}.snapshot")
+        return path, snapshot.finish(path, complete=complete)
+
+    def test_only_new_and_changed_rows_are_emitted(self):
+        snapshot = RowSnapshot()
+        self.assertTrue(snapshot.update(['1'], ('1', 'a')))
+        self.assertTrue(snapshot.update(['2'], ('2', 'b')))
+        path, deleted = self._finish(snapshot)
+        self.assertEqual(deleted, [])
+
+        snapshot = RowSnapshot(path)
+        self.assertFalse(snapshot.update(['1'], ('1', 'a')))
+        self.assertTrue(snapshot.update(['3'], ('3', 'c')))
+        path, deleted = self._finish(snapshot)
+        self.assertEqual(deleted, [['2']])
+        self.assertEqual((snapshot.inserted, snapshot.changed, snapshot.unchanged), (1, 0, 1))
+
+        snapshot = RowSnapshot(path)
+        self.assertTrue(snapshot.update(['1'], ('1', 'changed')))
+        self.assertEqual(snapshot.changed, 1)
+
+    def test_incomplete_run_keeps_unseen_rows(self):
+        snapshot = RowSnapshot()
+        for i in range(100):
+            snapshot.update([str(i)], (str(i), 'a'))
+        path, _ = self._finish(snapshot)
+
+        snapshot = RowSnapshot(path)
+        snapshot.update(['1'], ('1', 'a'))
+        path, deleted = self._finish(snapshot, complete=False)
+        self.assertEqual(deleted, [])
+
+        snapshot = RowSnapshot(path)
+        self.assertFalse(snapshot.update(['2'], ('2', 'a')))
+        self.assertFalse(snapshot.update(['1'], ('1', 'a')))
+        path, deleted = self._finish(snapshot)
+        self.assertEqual(sorted(int(pk[0]) for pk in deleted), [i for i in range(100) if i not in (1, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import gzip
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas
+
+from writer import SlicedTableWriter, to_json
+
+
+class TestSlicedTableWriter(unittest.TestCase):
+
+    def test_rows_are_split_into_compressed_slices(self):
+        path = os.path.join(tempfile.mkdtemp(), 'pbi_users.csv')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            writer = SlicedTableWriter(path, executor, slice_size=10)
+            for i in range(5):
+                writer.write(pandas.DataFrame({'id': [str(i)], 'name': ['user']}), ['id', 'name'])
+            writer.close()
+
+        slices = sorted(os.listdir(path))
+        self.assertEqual(len(slices), writer.slices)
+        self.assertTrue(all(name.endswith('.csv.gz') for name in slices))
+
+        content = ''
+        for name in slices:
+            with gzip.open(os.path.join(path, name), 'rt') as f:
+                content += f.read()
+        self.assertEqual(content.splitlines(), [f"{i},user" for i in range(5)])
+
+    def test_nested_values_are_compact_json(self):
+        self.assertEqual(to_json([{'targetDatasetId': 'd1', 'groupId': 'g1'}]),
+                         '[{"targetDatasetId":"d1","groupId":"g1"}]')
+        self.assertEqual(to_json('text'), 'text')
+
+
+if __name__ == "__main__":
+    unittest.main()